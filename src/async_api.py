@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import Executor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+from src.context import Context
+from src.file_system import FileSystem
+from src.paths_to_inodes_paths import directory_to_inodes_paths, inode_or_none
+from src.renamings import Renamer, independent_groups
+from src.secure_clauses import secure_clauses
+from src.user_errors import NoItemToRenameError, RecoverableRenamingError
+from src.user_types import Arc, Clause, InodesPaths
+
+
+class AsyncRenamer:
+    """Drive a renaming session from asyncio, without blocking the event loop.
+
+    Each blocking step is delegated to an executor (by default, the one of the loop), and at most
+    `concurrency` of them are in flight at the same time. The other coroutines keep running
+    meanwhile, which matters on high-latency file systems where each call is a round trip.
+
+    The steps mirror those of `do_renamings()`, except the edition of the names, which is left to
+    the caller (e.g., with `get_editable_text()` and `parse_edited_text()`).
+    """
+
+    def __init__(
+        self,
+        context: Context,
+        concurrency: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ):
+        self.context = context
+        self.concurrency = concurrency or context.config.get("async_concurrency", 8)
+        self.executor = executor
+        self.semaphore: Optional[asyncio.Semaphore] = None  # bound to the running loop
+        self.renamer = Renamer(context)
+
+    async def run(self, function: Callable, *args: Any) -> Any:
+        """Call a blocking function in the executor, once a slot is available."""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(function, *args))
+
+    async def scan(self, path: Path, max_depth: Optional[int] = 1) -> InodesPaths:
+        """Same as `do_renamings()` for a single path: map the inodes of the items to rename.
+
+        For a directory, these are the directory and its descendants down to `max_depth` (`None`
+        for the whole tree), filtered by the patterns of the configuration. Otherwise, this is the
+        path itself.
+        """
+        if not await self.run(path.is_dir):
+            return await self.paths_to_inodes_paths([path])
+        include = self.context.config.get("include", [])
+        exclude = self.context.config.get("exclude", [])
+        logger = self.context.logger
+        skip = lambda e: logger.warning(f"Skipping a folder which cannot be listed: {e}.")
+        return await self.run(directory_to_inodes_paths, path, max_depth, include, exclude, skip)
+
+    async def paths_to_inodes_paths(self, paths: List[Path]) -> InodesPaths:
+        """Same as `paths_to_inodes_paths()`, but with the paths `stat`-ed concurrently."""
+
+        inodes = await asyncio.gather(*(self.run(inode_or_none, path) for path in paths))
+        missing_paths = [path for (path, inode) in zip(paths, inodes) if inode is None]
+        if missing_paths:
+            n = len(missing_paths)
+            raise FileNotFoundError(f"{n} missing item{'s'[:n^1]}: {list(map(str,missing_paths))}.")
+        if not paths:
+            raise NoItemToRenameError("No item to rename was provided.")
+        return {inode: path for (path, inode) in zip(paths, inodes)}
+
+    async def secure_clauses(self, clauses: List[Clause]) -> List[Arc]:
+        """Plan the renamings in the executor, as configured for `do_renamings()`."""
+        lazy = self.context.config.get("lazy_file_system", False)
+        return await self.run(secure_clauses, FileSystem(lazy=lazy), clauses, self.renamer.planner)
+
+    async def perform_renamings(self, arcs: List[Arc]) -> int:
+        """Same as `Renamer.perform_renamings()`, with the independent groups run concurrently."""
+        n = self.renamer.start_renamings(len(arcs))
+        try:
+            await self.rename_and_log_all_files(arcs)
+        except Exception as e:
+            raise self.renamer.renamings_failed("perform_renamings", e)
+        return self.renamer.end_renamings(n)
+
+    async def rollback_renamings(self) -> int:
+        """Same as `Renamer.rollback_renamings()`."""
+        arcs_to_rollback = self.renamer.start_rollback()
+        try:
+            await self.rename_and_log_all_files(arcs_to_rollback)
+        except Exception as e:
+            self.context.logger.error(f"rollback_renamings: {e}")
+            raise
+        return self.renamer.end_rollback(len(arcs_to_rollback))
+
+    async def rename_and_log_all_files(self, arcs: List[Arc]) -> int:
+        """Same as `Renamer.rename_and_log_all_files()`, level by level, each group in a slot.
+
+        Raises:
+            The error of the first failing group, once all the groups of its level are done.
+        """
+        renamer = self.renamer
+        renamer.open_session()
+        try:
+            for groups in independent_groups(arcs):
+                results = await asyncio.gather(
+                    *(self.run(renamer.rename_and_log_group, group) for group in groups),
+                    return_exceptions=True,
+                )
+                for result in results:
+                    if isinstance(result, BaseException):
+                        raise result
+        finally:  # even on failure, the log and the index must reflect the completed renamings
+            await self.run(renamer.close_session)
+        return renamer.print_completed()
+
+    async def rename(self, clauses: List[Clause]) -> int:
+        """Plan and perform the given clauses, and roll them back on failure.
+
+        Raises:
+            RecoverableRenamingError: the renamings failed, but were successfully rolled back.
+        """
+        arcs = await self.secure_clauses(clauses)
+        try:
+            return await self.perform_renamings(arcs)
+        except RecoverableRenamingError:
+            await self.rollback_renamings()
+            raise
@@ -12,6 +12,20 @@ class Context:
     DEFAULT_CONFIG = {
         "editor_command": "",
         "logs_to_keep": 10,
+        "journal_durability": "group",
+        "journal_group_size": 64,
+        "include": [],
+        "exclude": [],
+        "stat_threads": 1,
+        "lazy_file_system": False,
+        "planner": "greedy",
+        "planning_processes": 1,
+        "stream_renamings": False,
+        "rename_strategy": "git",
+        "git_index": "subprocess",
+        "rename_engine": "path",
+        "renaming_threads": 1,
+        "async_concurrency": 8,
     }
 
     def __init__(self, platform_name: str = "", full=True):
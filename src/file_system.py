@@ -1,15 +1,48 @@
+import os
 from base64 import b32encode
-from itertools import count
-from pathlib import Path
-from typing import Generator, Iterable, Optional, Set
+from collections.abc import MutableSet
+from pathlib import Path, PurePath
+from typing import Dict, Generator, Iterable, Iterator, List, Mapping, Optional, Set
 
 from pathvalidate import validate_filename
 
 
-class FileSystem(set):
-    def __init__(self, paths: Optional[Iterable[Path]] = None, platform: Optional[str] = None):
+class Node:
+    """A node of the file tree, which may or may not belong to the file system.
+
+    The non-present nodes are merely intermediate: they connect the present ones to the root.
+    """
+
+    __slots__ = ("name", "parent", "children", "present")
+
+    def __init__(self, name: str = "", parent: Optional["Node"] = None):
+        self.name = name
+        self.parent = parent
+        self.children: Dict[str, Node] = {}
+        self.present = False
+
+
+class FileSystem(MutableSet):
+    """A set of paths, stored as a tree where each node maps its children by name.
+
+    Looking up a path or its siblings costs O(depth), and renaming a subtree costs O(depth) too,
+    since only the renamed node is relinked, whatever the number of its descendants.
+    """
+
+    def __init__(
+        self,
+        paths: Optional[Iterable[Path]] = None,
+        platform: Optional[str] = None,
+        lazy: bool = False,
+        temporary_prefix: Optional[str] = None,
+    ):
+        self.root = Node()
+        self.size = 0
+        self.temporary_names = TemporaryNames(self, temporary_prefix)
+        self.listings: Optional[Dict[Path, Set[str]]] = None  # memoized by `listing()`
+        self.absent: Optional[Set[Path]] = None  # known to be absent in a lazy file system
         if paths:  # when some initial paths are provided, the file system is considered as pure
-            super().__init__(paths)
+            self.update(paths)
             for path in self:
                 validate_filename(
                     path.name,
@@ -17,10 +50,90 @@ class FileSystem(set):
                 )  # validate each filename when working with a pure FileSystem
             self.path_exists = lambda path: path in self
             self.siblings = lambda path: self.children(path.parent)
+        elif lazy:  # a concrete file system where only the needed paths are probed
+            self.absent = set()
+            self.path_exists = lambda path: path in self
+            self.siblings = lambda path: (path,)
         else:  # otherwise, the file system is considered as concrete
-            super().__init__()
-            self.path_exists = lambda path: path.exists()
-            self.siblings = lambda path: path.parent.glob("*")
+            self.listings = {}
+            self.path_exists = self.is_listed
+            self.siblings = lambda path: (path.parent / name for name in self.listing(path.parent))
+
+    @classmethod
+    def _from_iterable(cls, paths: Iterable[Path]) -> Set[Path]:
+        """Make the set operators (`-`, `&`, etc.) return plain sets of paths."""
+        return set(paths)
+
+    def __contains__(self, path) -> bool:
+        if not isinstance(path, PurePath):
+            return False
+        if self.holds(path):
+            return True
+        if self.absent is None or path in self.absent:
+            return False
+        self.probe([path])
+        return path not in self.absent
+
+    def __iter__(self) -> Iterator[Path]:
+        stack = [(Path(), self.root)]
+        while stack:
+            (path, node) = stack.pop()
+            if node.present:
+                yield path
+            stack.extend((path / name, child) for (name, child) in node.children.items())
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({set(self)!r})"
+
+    def find(self, path: Path) -> Optional[Node]:
+        """Return the node of the given path, or `None` if the tree does not contain it."""
+        node = self.root
+        for part in path.parts:
+            child = node.children.get(part)
+            if child is None:
+                return None
+            node = child
+        return node
+
+    def make(self, path: Path) -> Node:
+        """Return the node of the given path, creating it and its missing ancestors if needed."""
+        node = self.root
+        for part in path.parts:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = Node(part, node)
+            node = child
+        return node
+
+    def add(self, path: Path) -> None:
+        node = self.make(path)
+        if not node.present:
+            node.present = True
+            self.size += 1
+        if self.absent is not None:
+            self.absent.discard(path)
+
+    def discard(self, path: Path) -> None:
+        node = self.find(path)
+        if node is not None and node.present:
+            node.present = False
+            self.size -= 1
+            self.prune(node)
+        if self.absent is not None:
+            self.absent.add(path)
+
+    def update(self, paths: Iterable[Path]) -> None:
+        for path in paths:
+            self.add(path)
+
+    def prune(self, node: Node) -> None:
+        """Remove a node and its ancestors as long as they are neither present nor useful."""
+        while node.parent is not None and not node.present and not node.children:
+            del node.parent.children[node.name]
+            node = node.parent
 
     def update_with_source_paths(self, source_paths: Iterable[Path]) -> None:
         """Check all paths exist in the file system and "close" it with their siblings.
@@ -32,16 +145,92 @@ class FileSystem(set):
             FileNotFoundError: a source path is absent from the file system.
         """
         result: Set[Path] = set()
+        closed_parents: Set[Path] = set()
         for source_path in source_paths:
             if not self.path_exists(source_path):
                 raise FileNotFoundError(source_path)
-            result.update(self.siblings(source_path))
+            if source_path.parent not in closed_parents:  # add each group of siblings only once
+                closed_parents.add(source_path.parent)
+                result.update(self.siblings(source_path))
         self.update(result)  # should not change a pure file system
 
+    def listing(self, directory: Path) -> Set[str]:
+        """List the entries of a concrete directory, once per session.
+
+        Args:
+            directory (Path): the parent of some source paths.
+
+        Returns:
+            Set[str]: the names of the entries. An unreadable directory is treated as empty.
+        """
+        assert self.listings is not None, "a pure file system has no concrete directory to list"
+        result = self.listings.get(directory)
+        if result is None:
+            try:
+                with os.scandir(directory) as entries:
+                    result = {entry.name for entry in entries}
+            except OSError:
+                result = set()
+            self.listings[directory] = result
+        return result
+
+    def probe(self, paths: Iterable[Path], sources: Optional[Mapping[Path, Path]] = None) -> None:
+        """In a lazy file system, `lstat` in one pass those of the given paths not probed yet.
+
+        The paths found are added to the file system, and the others recorded as absent. No path
+        is probed when the file system is pure or eagerly populated.
+
+        Args:
+            paths (Iterable[Path]): the paths to probe.
+            sources (Optional[Mapping[Path, Path]]): for the targets of some clauses, their source.
+                On a case-insensitive file system (the default on macOS and Windows), `lstat` finds
+                `Foo` when only `foo` exists. A target found to be the very item of its source is
+                thus recorded as absent, like in the listing of an eager file system.
+
+        Notes:
+            The virtual renamings are reflected without any further probing: the source becomes
+            absent, and the target present. This is sound as long as no descendant of a renamed
+            folder is probed afterwards, which `secure_clauses()` ensures by processing the most
+            nested clauses first. In any case, the descendants of a path known as absent are
+            considered absent too.
+        """
+        if self.absent is None:
+            return
+        for path in paths:
+            if path in self.absent or self.holds(path):
+                continue
+            if any(ancestor in self.absent for ancestor in path.parents):
+                self.absent.add(path)
+                continue
+            try:
+                stat = os.lstat(path)
+            except OSError:
+                self.absent.add(path)
+                continue
+            source = sources.get(path) if sources else None
+            if source is not None and source != path and is_same_item(stat, source):
+                self.absent.add(path)  # e.g., a case-only renaming
+            else:
+                self.add(path)
+
+    def holds(self, path: Path) -> bool:
+        """Tell whether a path has already been added to the file system, without probing it."""
+        node = self.find(path)
+        return node is not None and node.present
+
+    def is_listed(self, path: Path) -> bool:
+        """Tell whether a concrete path exists, preferably without any system call."""
+        if path.name in self.listing(path.parent):
+            return True
+        return path.exists()  # e.g., a root, an unreadable parent or a case-insensitive match
+
     def children(self, path: Path) -> Generator[Path, None, None]:
-        for candidate in self:
-            if candidate.match(f"{path}/*"):
-                yield candidate
+        node = self.find(path)
+        if node is None:
+            return
+        for (name, child) in node.children.items():
+            if child.present:
+                yield path / name
 
     def non_existing_sibling(self, path: Path) -> Path:
         """Create the path of a non-existing sibling of a given path.
@@ -51,23 +240,18 @@ class FileSystem(set):
 
         Returns:
             Path: the path to be temporarily used for an intermediate renaming.
-        
+
         Examples:
-            "foobar.txt" -> "MZXW6YTBOIXHI6DU-0"
+            "foobar.txt" -> "MZXW6YTB-0", where "MZXW6YTB" is the prefix of the session.
 
         Notes:
             - A previous version relied on `Path.with_stem`, which requires Python 3.9. In the
             present version, the non existing sibling does not conserve the extension of the
             original file.
-            - Truncated SHA-256 and BASE-64 were considered, but the former is overkill, and the
-            character set of the latter is not appropriate for filenames.
+            - Another previous version derived the name from a BASE-32 digest of the original name,
+            which needed a fresh series of membership tests for each intermediate renaming.
         """
-        digest = b32encode(path.name.encode("utf8")).decode("ascii")[:32]
-        for suffix in count():
-            new_path = path.with_name(f"{digest}-{suffix}")
-            if new_path not in self:
-                break
-        return new_path
+        return self.temporary_names.allocate(path.parent)
 
     def rename(self, path, new_path):
         """Rename a path into a new path, and rename recursively its descendants.
@@ -88,9 +272,107 @@ class FileSystem(set):
                 Nevertheless, all the consequences of a renaming (specifically, of a folder) are
                 simulated to ensure testability.
             - In a virtual file system, renaming a node before its parent is not mandatory.
+            - The descendants are not visited: the node of `path` is simply relinked under its new
+                name, unless `new_path` already has a node, in which case both subtrees are merged.
+        """
+        node = self.find(path)
+        if node is None or node.parent is None:  # unknown path, or root
+            return
+        old_parent = node.parent
+        del old_parent.children[node.name]
+        new_parent = self.make(new_path.parent)
+        node.name = new_path.name
+        existing = new_parent.children.get(node.name)
+        if existing is None:
+            node.parent = new_parent
+            new_parent.children[node.name] = node
+        else:
+            self.merge(node, existing)
+        self.prune(old_parent)
+        if self.absent is not None:
+            self.absent.add(path)
+            self.absent.discard(new_path)
+
+    def exchange(self, path: Path, other_path: Path) -> None:
+        """Swap two sibling paths of the file system, along with their descendants.
+
+        Both paths are normally in the file system. Like `rename()`, the swap is virtual only, and
+        costs O(depth) whatever the number of descendants.
         """
-        offset = len(str(path)) + 1
-        for candidate in list(self):
-            if candidate == path or str(candidate).startswith(f"{path}/"):
-                self.remove(candidate)
-                self.add(new_path / str(candidate)[offset:])
+        (node, other) = (self.find(path), self.find(other_path))
+        if node is None or other is None or node.parent is None or node.parent is not other.parent:
+            return
+        (node.name, other.name) = (other.name, node.name)
+        node.parent.children[node.name] = node
+        node.parent.children[other.name] = other
+
+    def merge(self, node: Node, into: Node) -> None:
+        """Move the content of a detached node into an existing one, recursively."""
+        if node.present:
+            if into.present:
+                self.size -= 1
+            else:
+                into.present = True
+        for (name, child) in node.children.items():
+            existing = into.children.get(name)
+            if existing is None:
+                child.parent = into
+                into.children[name] = child
+            else:
+                self.merge(child, existing)
+
+
+def is_same_item(stat: os.stat_result, path: Path) -> bool:
+    """Tell whether the result of a `stat` is that of the item at a given path."""
+    try:
+        other = os.lstat(path)
+    except OSError:
+        return False
+    return (stat.st_dev, stat.st_ino) == (other.st_dev, other.st_ino)
+
+
+class TemporaryNames:
+    """Allocate the names of the intermediate renamings, folder by folder.
+
+    All the names consist of a prefix drawn once per session and of a counter specific to each
+    folder. They are reserved by batches, whose existence is checked in a single pass. Once an
+    intermediate renaming is completed, its name can be released and reused by the next one.
+    """
+
+    def __init__(self, file_system: FileSystem, prefix: Optional[str] = None, batch_size=16):
+        self.file_system = file_system
+        self.prefix = prefix or b32encode(os.urandom(5)).decode("ascii")
+        self.batch_size = batch_size
+        self.counters: Dict[Path, int] = {}
+        self.free: Dict[Path, List[Path]] = {}  # stacks of names reserved or released
+        self.allocated: Set[Path] = set()
+
+    def reserve(self, directory: Path, n: int) -> None:
+        """Add to the free names of a folder `n` names absent from the file system."""
+        fresh: List[Path] = []
+        while len(fresh) < n:
+            start = self.counters.get(directory, 0)
+            stop = start + n - len(fresh)
+            candidates = [directory / f"{self.prefix}-{i}" for i in range(start, stop)]
+            self.counters[directory] = stop
+            self.file_system.probe(candidates)
+            fresh.extend(candidate for candidate in candidates if candidate not in self.file_system)
+        self.free.setdefault(directory, []).extend(reversed(fresh))  # pop the smallest first
+
+    def allocate(self, directory: Path) -> Path:
+        """Return a name absent from the given folder, and consider it as used until released."""
+        free = self.free.get(directory)
+        while True:
+            if not free:
+                self.reserve(directory, self.batch_size)
+                free = self.free[directory]
+            path = free.pop()
+            if path not in self.file_system:  # it may have been taken since its reservation
+                self.allocated.add(path)
+                return path
+
+    def release(self, path: Path) -> None:
+        """Make the name of a completed intermediate renaming available again (or do nothing)."""
+        if path in self.allocated:
+            self.allocated.remove(path)
+            self.free[path.parent].append(path)
@@ -0,0 +1,371 @@
+import hashlib
+import os
+import re
+import struct
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+
+class IndexEntry(NamedTuple):
+    mode: str
+    object_name: str
+
+
+def repository_root(directory: Path, cache: Dict[Path, Optional[Path]]) -> Optional[Path]:
+    """Return the root of the git working tree containing a given directory, if any.
+
+    No git process is spawned: the directory and its ancestors are searched for a `.git` entry
+    (either a folder, or a file for worktrees and submodules). Each folder visited is cached with
+    its result, so that each root is found only once per session. The given directory is cached
+    as is too, since resolving it costs a `lstat()` per component: this is only done on a miss.
+
+    Args:
+        directory (Path): a folder (typically, the parent of a renamed file).
+        cache (Dict[Path, Optional[Path]]): a mapping of the paths already visited (as given, or
+            resolved) to their root, or to `None` for the folders outside any working tree.
+    """
+    if directory in cache:
+        return cache[directory]
+    visited = [directory]
+    folder = Path(os.path.realpath(directory))
+    while True:
+        if folder in cache:
+            result = cache[folder]
+            break
+        visited.append(folder)
+        if os.path.lexists(folder / ".git"):
+            result = folder
+            break
+        if folder.parent == folder:
+            result = None
+            break
+        folder = folder.parent
+    for folder in visited:
+        cache[folder] = result
+    return result
+
+
+def read_index_entries(root: Path) -> Dict[str, IndexEntry]:
+    """Prefetch the tracked files of a repository with a single `git ls-files` call.
+
+    Returns:
+        Dict[str, IndexEntry]: the entries keyed by their path relative to the root. The conflicting
+            entries are left out: like `git mv`, a batch cannot move them.
+    """
+    process = subprocess.run(
+        ["git", "-C", root, "ls-files", "--stage", "-z"],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    result = {}
+    for record in process.stdout.split(b"\0"):
+        if not record:
+            continue
+        (info, _, path) = record.partition(b"\t")
+        (mode, object_name, stage) = info.decode("ascii").split(" ")
+        if stage == "0":
+            result[os.fsdecode(path)] = IndexEntry(mode, object_name)
+    return result
+
+
+class IndexBatch:
+    """The renamings of the tracked files of a repository, to be written at once in its index.
+
+    The renamings are first simulated on an in-memory copy of the index entries. Then, `flush()`
+    writes the net difference with a single `git update-index` call, preserving the object names
+    and the modes, exactly like a sequence of `git mv` would do. The batch remains usable after
+    that, so that the index is read only once per session.
+
+    Raises:
+        FileNotFoundError: git is not installed.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.real_parents: Dict[Path, str] = {}
+        self.load()
+
+    def load(self) -> None:
+        """Read the entries of the index, and index their folders."""
+        self.original: Dict[str, Any] = read_index_entries(self.root)
+        self.current = dict(self.original)
+        self.folders: Set[str] = set()  # the folders containing at least one tracked file
+        for path in self.current:
+            self.add_folders(path)
+
+    def add_folders(self, path: str) -> None:
+        (folder, _, _) = path.rpartition("/")
+        while folder and folder not in self.folders:
+            self.folders.add(folder)
+            (folder, _, _) = folder.rpartition("/")
+
+    def relative(self, path: Path) -> str:
+        """Return the path of a file of the working tree, relative to its root, in POSIX style."""
+        parent = self.real_parents.get(path.parent)
+        if parent is None:
+            parent = Path(os.path.relpath(os.path.realpath(path.parent), self.root)).as_posix()
+            self.real_parents[path.parent] = parent
+        return path.name if parent == "." else f"{parent}/{path.name}"
+
+    def move(self, source: Path, target: Path) -> bool:
+        """Simulate the renaming of a file or folder in the index.
+
+        Returns:
+            bool: `True` iff the source is tracked, or contains at least one tracked file.
+        """
+        taken = self.take(self.relative(source))
+        self.put(self.relative(target), taken)
+        return bool(taken)
+
+    def exchange(self, source: Path, target: Path) -> bool:
+        """Simulate the swap of two files or folders in the index.
+
+        Returns:
+            bool: `True` iff at least one of them is tracked, or contains a tracked file.
+        """
+        (source_path, target_path) = (self.relative(source), self.relative(target))
+        (taken, taken_back) = (self.take(source_path), self.take(target_path))
+        self.put(target_path, taken)
+        self.put(source_path, taken_back)
+        return bool(taken or taken_back)
+
+    def take(self, path: str) -> Dict[str, Any]:
+        """Remove the entries of a file or a folder, and return them keyed by their suffix."""
+        entry = self.current.pop(path, None)
+        if entry is not None:
+            return {"": entry}
+        if path not in self.folders:
+            return {}
+        prefix = f"{path}/"
+        suffixes = [p[len(path) :] for p in self.current if p.startswith(prefix)]
+        return {suffix: self.current.pop(f"{path}{suffix}") for suffix in suffixes}
+
+    def put(self, path: str, taken: Dict[str, Any]) -> None:
+        """Insert under a new path the entries returned by `take()`."""
+        for (suffix, entry) in taken.items():
+            self.current[f"{path}{suffix}"] = entry
+            self.add_folders(f"{path}{suffix}")
+
+    def flush(self) -> None:
+        """Write the net result of the simulated renamings in the index."""
+        records = []
+        for path in self.original.keys() - self.current.keys():
+            records.append(f"0 {'0' * len(self.original[path].object_name)}\t{path}")
+        for (path, entry) in self.current.items():
+            if self.original.get(path) != entry:
+                records.append(f"{entry.mode} {entry.object_name}\t{path}")
+        if records:
+            subprocess.run(
+                ["git", "-C", self.root, "update-index", "-z", "--index-info"],
+                input=b"".join(os.fsencode(record) + b"\0" for record in records),
+                check=True,
+                stderr=subprocess.PIPE,
+            )
+        self.original = dict(self.current)
+
+
+class RawEntry(NamedTuple):
+    stat: bytes  # ctime, mtime, dev, ino, mode, uid, gid and size, in the binary format of git
+    object_name: bytes
+    flags: int  # without the name length
+    extended_flags: Optional[int]  # version 3 and above only
+
+
+class IndexFile:
+    """The index of a repository, read and written in process.
+
+    The versions 2, 3 and 4 of the format are supported. The extensions which only serve as caches
+    (e.g., the cache tree) are dropped, since they may be invalidated by the renamings, and git
+    rebuilds them when needed. An index requiring an unknown extension is rejected.
+
+    Reference: https://git-scm.com/docs/index-format
+    """
+
+    KEPT_EXTENSIONS = {b"REUC"}  # resolve undo, keyed by paths which are not renamed
+
+    def __init__(self, path: Path, hash_size: int):
+        self.path = path
+        self.hash_size = hash_size
+        data = path.read_bytes()
+        if hashlib.new(self.hash_name(), data[:-hash_size]).digest() != data[-hash_size:]:
+            raise ValueError(f"Corrupted index file '{path}'.")
+        (signature, self.version, count) = struct.unpack(">4sLL", data[:12])
+        if signature != b"DIRC" or self.version not in (2, 3, 4):
+            raise ValueError(f"Unsupported index file '{path}'.")
+        self.entries: List[Tuple[bytes, RawEntry]] = []  # couples (path, entry), sorted by path
+        offset = 12
+        path_bytes = b""
+        for _ in range(count):
+            start = offset
+            stat = data[offset : offset + 40]
+            offset += 40
+            object_name = data[offset : offset + hash_size]
+            offset += hash_size
+            (flags,) = struct.unpack(">H", data[offset : offset + 2])
+            offset += 2
+            extended_flags = None
+            if flags & 0x4000:
+                (extended_flags,) = struct.unpack(">H", data[offset : offset + 2])
+                offset += 2
+            if self.version == 4:
+                (stripped, offset) = decode_varint(data, offset)
+                end = data.index(b"\0", offset)
+                path_bytes = path_bytes[: len(path_bytes) - stripped] + data[offset:end]
+                offset = end + 1
+            else:
+                end = data.index(b"\0", offset)
+                path_bytes = data[offset:end]
+                offset = start + (end - start + 8) // 8 * 8  # 1 to 8 padding NULs
+            entry = RawEntry(stat, object_name, flags & ~0xFFF, extended_flags)
+            self.entries.append((path_bytes, entry))
+        self.extensions: List[Tuple[bytes, bytes]] = []
+        while offset < len(data) - hash_size:
+            (signature, size) = struct.unpack(">4sL", data[offset : offset + 8])
+            if not signature[:1].isupper():
+                raise ValueError(f"Unsupported index extension {signature!r} in '{path}'.")
+            if signature in self.KEPT_EXTENSIONS:
+                self.extensions.append((signature, data[offset + 8 : offset + 8 + size]))
+            offset += 8 + size
+
+    def hash_name(self) -> str:
+        return "sha1" if self.hash_size == 20 else "sha256"
+
+    def to_bytes(self) -> bytes:
+        """Serialize the index, with its entries sorted and its checksum updated."""
+        self.entries.sort(key=lambda item: (item[0], (item[1].flags >> 12) & 3))
+        chunks = [struct.pack(">4sLL", b"DIRC", self.version, len(self.entries))]
+        previous_path = b""
+        for (path, entry) in self.entries:
+            flags = entry.flags | min(len(path), 0xFFF)
+            chunk = entry.stat + entry.object_name + struct.pack(">H", flags)
+            if entry.extended_flags is not None:
+                chunk += struct.pack(">H", entry.extended_flags)
+            if self.version == 4:
+                common = len(os.path.commonprefix([previous_path, path]))
+                chunk += encode_varint(len(previous_path) - common) + path[common:] + b"\0"
+                previous_path = path
+            else:
+                chunk += path
+                chunk += b"\0" * (8 - len(chunk) % 8)  # 1 to 8 padding NULs
+            chunks.append(chunk)
+        for (signature, extension) in self.extensions:
+            chunks.append(struct.pack(">4sL", signature, len(extension)) + extension)
+        data = b"".join(chunks)
+        return data + hashlib.new(self.hash_name(), data).digest()
+
+
+def decode_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """Decode the offset encoding of git, and return the value and the next offset."""
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return (value, offset)
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode a value with the offset encoding of git."""
+    result = [value & 0x7F]
+    value >>= 7
+    while value:
+        value -= 1
+        result.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(result))
+
+
+def git_directory(root: Path) -> Path:
+    """Return the git directory of a working tree, following the `.git` file of a worktree."""
+    dot_git = root / ".git"
+    if dot_git.is_file():
+        gitdir = dot_git.read_text().strip().partition("gitdir:")[2].strip()
+        return (root / gitdir).resolve()
+    return dot_git
+
+
+def hash_size(git_dir: Path) -> int:
+    """Return the size of the object names of a repository (SHA-1 by default, or SHA-256)."""
+    common_dir = git_dir
+    if (git_dir / "commondir").is_file():
+        common_dir = (git_dir / (git_dir / "commondir").read_text().strip()).resolve()
+    try:
+        config = (common_dir / "config").read_text()
+    except FileNotFoundError:
+        return 20
+    return 32 if re.search(r"(?im)^\s*objectformat\s*=\s*sha256\s*$", config) else 20
+
+
+class InProcessIndexBatch(IndexBatch):
+    """Same as `IndexBatch`, but without any git process: the index is read and written directly.
+
+    Like git, the batch follows the `index.lock` protocol: the lock file is created exclusively
+    when the index is read, which prevents any concurrent modification, and the new index is
+    written into the lock file, then atomically renamed over the index by `flush()`. The next
+    renaming locks and reads the index again.
+
+    Raises:
+        FileExistsError: the index is locked by another process.
+        ValueError: the index is corrupted or in an unsupported format.
+    """
+
+    def load(self) -> None:
+        git_dir = git_directory(self.root)
+        if not git_dir.is_dir():
+            raise ValueError(f"No git directory found for '{self.root}'.")
+        self.index_path = git_dir / "index"
+        self.lock_path = git_dir / "index.lock"
+        self.lock_fd: Optional[int] = os.open(self.lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        try:
+            if self.index_path.exists():
+                self.index: Optional[IndexFile] = IndexFile(self.index_path, hash_size(git_dir))
+            else:  # a fresh repository
+                self.index = None
+        except Exception:
+            self.unlock()
+            raise
+        self.original = {}
+        self.conflicts: List[Tuple[bytes, RawEntry]] = []
+        for (path, entry) in self.index.entries if self.index else ():
+            if entry.flags & 0x3000:  # a non-zero stage
+                self.conflicts.append((path, entry))
+            else:
+                self.original[os.fsdecode(path)] = entry
+        self.current = dict(self.original)
+        self.folders = set()
+        for path in self.current:
+            self.add_folders(path)
+
+    def unlock(self) -> None:
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            self.lock_path.unlink()
+
+    def take(self, path: str) -> Dict[str, Any]:
+        if self.lock_fd is None:  # the index has been written since the previous renaming
+            self.load()
+        return super().take(path)
+
+    def flush(self) -> None:
+        """Write the whole index at once, or simply release it if no tracked file was renamed."""
+        if self.lock_fd is None:
+            return
+        if self.index is None or self.current == self.original:
+            return self.unlock()
+        try:
+            entries = [(os.fsencode(path), entry) for (path, entry) in self.current.items()]
+            self.index.entries = entries + self.conflicts
+            os.write(self.lock_fd, self.index.to_bytes())
+            os.fsync(self.lock_fd)
+            os.close(self.lock_fd)
+            self.lock_fd = None
+            os.replace(self.lock_path, self.index_path)
+        except Exception:
+            self.unlock()
+            raise
+        self.original = dict(self.current)
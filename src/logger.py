@@ -1,39 +1,128 @@
-import datetime
+import json
 import logging
 import os
-import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.session_store import Row, SessionStore
+from src.user_types import Arc
 
 
 class Logger:
     def __init__(self, context):
         self.log_dir = context.workspace
         self.path = self.log_dir / "log.txt"
+        self.index_path = self.log_dir / "log_index.json"  # the retained sessions
+        self.previous_path: Optional[Path] = None  # the log of the previous session, if any
         self.logs_to_keep = context.config.get("logs_to_keep", 10)
+        self.journal_durability = context.config.get("journal_durability", "group")
+        self.journal_group_size = context.config.get("journal_group_size", 64)
+        self.journal: Optional[Journal] = None
+        self.records_path = self.log_dir / "journal.jsonl"  # structured version of the log
+        self.previous_records_path = self.log_dir / "journal_previous.jsonl"
+        self.records_lock = threading.Lock()
+        self.counts = {"arcs": 0, "errors": 0}  # the footer of the records of the session
+        self.store_path = self.log_dir / "sessions.sqlite3"
+        self.store: Optional[SessionStore] = None  # opened with the first session
+        self.session = 0  # the number of the current session
 
     def create_new_log_file(self):
         """Remove all handlers associated with the root logger object and create a NEW log file."""
-        self.previous_log_contents = self.get_contents() # used by `get_arcs_for_undoing()`
-        self.backup_current_log_file()
+        self.rotate_log_file()
+        self.rotate_records()
+        if self.store is None:
+            self.store = SessionStore(self.store_path, sync=self.journal_durability != "none")
+        self.store.start_session(self.session)
         for handler in logging.root.handlers[:]:
             logging.root.removeHandler(handler)
         logging.basicConfig(filename=self.path, filemode="w", level=logging.DEBUG)
 
-    def backup_current_log_file(self):
-        """
-        Copy the current log file with a timestamp appended.
-        Clean up the directory by keeping only the last self.logs_to_keep copies.
+    def rotate_log_file(self):
+        """Rename the current log file after its session number, and prune the oldest ones.
+
+        The retained sessions are listed in a small index file, so that neither the copy of a log
+        nor the listing of the workspace is ever needed. The last session is retained even if
+        `"logs_to_keep"` is 0, since it is the one to undo.
         """
-        if self.logs_to_keep == 0:
+        index = self.read_log_index()
+        if not self.path.is_file():
+            self.previous_path = None  # make sure not to undo an older session
+            self.session = index["last"] + 1
             return
+        index["last"] += 1
+        index["sessions"].append(index["last"])
+        pruned = index["sessions"][: -max(1, self.logs_to_keep)]
+        index["sessions"] = index["sessions"][len(pruned) :]
+        self.write_log_index(index)  # first: an interruption never leads to reuse a number
+        self.previous_path = self.session_log_path(index["last"])
+        os.replace(self.path, self.previous_path)
+        self.session = index["last"] + 1  # the number its log will have once rotated
+        for session in pruned:
+            try:
+                self.session_log_path(session).unlink()
+            except FileNotFoundError:
+                pass
+
+    def session_log_path(self, session: int) -> Path:
+        return self.log_dir / f"log_{session}.txt"
+
+    def read_log_index(self) -> Dict[str, Any]:
         try:
-            modified = os.path.getmtime(self.path)
-        except FileNotFoundError:
-            return
-        suffix = datetime.datetime.fromtimestamp(modified).strftime("%Y-%m-%d_%H-%M-%S.%f")
-        destination = f"{self.path.parent}/log_{suffix}.txt"
-        shutil.copy2(self.path, destination)
-        for file in sorted(self.log_dir.glob("log_*.txt"), reverse=True)[self.logs_to_keep :]:
-            file.unlink()
+            return json.loads(self.index_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {"last": 0, "sessions": []}
+
+    def write_log_index(self, index: Dict[str, Any]):
+        temporary_path = self.index_path.with_name(f"{self.index_path.name}.tmp")
+        temporary_path.write_text(json.dumps(index))
+        os.replace(temporary_path, self.index_path)  # atomically
+
+    def retained_log_paths(self) -> List[Path]:
+        """Return the paths of the logs of the retained sessions, from the oldest one."""
+        return [self.session_log_path(session) for session in self.read_log_index()["sessions"]]
+
+    def rotate_records(self):
+        """Keep the structured records of the previous session (if any) for undoing it."""
+        try:
+            os.replace(self.records_path, self.previous_records_path)
+        except FileNotFoundError:  # make sure not to undo an older session
+            try:
+                self.previous_records_path.unlink()
+            except FileNotFoundError:
+                pass
+        self.counts = {"arcs": 0, "errors": 0}
+
+    def write_records(
+        self,
+        records: List[str],
+        arcs: int = 0,
+        errors: int = 0,
+        footer: bool = False,
+        sync: bool = False,
+    ):
+        """Append some JSON lines to the structured records of the session.
+
+        Args:
+            records (List[str]): the lines to append, each ending with a newline.
+            arcs (int): the number of arcs among them.
+            errors (int): the number of errors among them.
+            footer (bool): whether to append the counts of the whole session after them. The last
+                footer spares the undoing a full pass over the records (see `read_records()`).
+            sync (bool): whether to sync the file to the disk.
+        """
+        with self.records_lock:
+            self.counts["arcs"] += arcs
+            self.counts["errors"] += errors
+            if footer:
+                records = records + [json.dumps(self.counts) + "\n"]
+            if not records:
+                return
+            with open(self.records_path, "a", encoding="ascii") as file:
+                file.write("".join(records))
+                if sync:
+                    file.flush()
+                    os.fsync(file.fileno())
 
     def get_contents(self):  # pragma: no cover
         if self.path.is_file():
@@ -41,11 +130,156 @@ class Logger:
         else:
             return ""
 
+    def get_previous_contents(self) -> str:
+        """Return the log of the previous session, used by `get_arcs_for_undoing()`."""
+        if self.previous_path is not None and self.previous_path.is_file():
+            return self.previous_path.read_text().strip()
+        else:
+            return ""
+
+    def open_journal(self) -> "Journal":
+        """Start journaling the arcs, with the durability and group size of the configuration."""
+        self.journal = Journal(self, self.journal_durability, self.journal_group_size)
+        return self.journal
+
+    def commit_journal(self):
+        """Commit the pending arcs before any other record, to keep the records in order.
+
+        This never raises: the caller may be reporting the very failure of the journal.
+        """
+        if self.journal is None:
+            return
+        try:
+            self.journal.commit()
+        except Exception as e:
+            logging.error(f"Failed to write the journal: {e}")
+
     def warning(self, *args, **kwargs):
+        self.commit_journal()
         logging.warning(*args, **kwargs)
 
     def info(self, *args, **kwargs):
+        self.commit_journal()
         logging.info(*args, **kwargs)
 
-    def error(self, *args, **kwargs):
-        logging.error(*args, **kwargs)
+    def error(self, message: str, *args, **kwargs):
+        self.commit_journal()
+        logging.error(message, *args, **kwargs)
+        record = json.dumps({"error": message}) + "\n"
+        self.write_records([record], errors=1, footer=True, sync=self.journal_durability != "none")
+        if self.store is not None:
+            self.store.add_error()
+
+
+class Journal:
+    """Write the completed arcs in the log files by groups, instead of one logging call per arc.
+
+    Each arc is recorded in up to three places:
+
+    - in the log file, with the line `Logger.info()` would write, for the human reader;
+    - in the structured records, as a JSON list `[flags, source, target]`, for the undoing;
+    - in the session store, if any, for the undoing of several sessions.
+
+    All are buffered, then written and flushed at once. A group is committed when it is full, when
+    the journal is closed (with a footer in the records), and before any other record is logged.
+    Its durability depends on the mode:
+
+    - "none": the group is flushed to the operating system, but not synced to the disk;
+    - "group": the group is synced to the disk with a single `fsync()` per file;
+    - "arc": each arc is written and synced on its own, which is the slowest and safest.
+
+    When the log file is not set up (no file handler), the lines are simply logged one by one.
+    """
+
+    DURABILITIES = ("none", "group", "arc")
+
+    def __init__(self, logger: Logger, durability: str = "group", group_size: int = 64):
+        if durability not in self.DURABILITIES:
+            raise ValueError(f"Unknown journal durability '{durability}'.")
+        self.logger = logger
+        self.durability = durability
+        self.group_size = 1 if durability == "arc" else max(1, group_size)
+        self.buffer: List[str] = []  # the lines of the log file
+        self.records: List[str] = []  # the lines of the structured records
+        self.rows: List[Row] = []  # the rows of the session store
+        self.lock = threading.Lock()
+        self.handler = next(
+            (h for h in logging.root.handlers if isinstance(h, logging.FileHandler)), None
+        )
+
+    def append(self, flags: str, arc: Arc) -> None:
+        """Add a completed arc to the current group, and commit the group if full."""
+        message = f"{flags}SOURCE:{arc.source}\tTARGET:{arc.target}"
+        row = (flags, str(arc.source), str(arc.target))
+        record = json.dumps(row) + "\n"
+        with self.lock:
+            if self.handler is None:
+                logging.info(message)
+            else:
+                self.buffer.append(f"INFO:{logging.root.name}:{message}\n")
+            self.records.append(record)
+            self.rows.append(row)
+            if len(self.records) >= self.group_size:
+                self.commit_buffer()
+
+    def commit(self, footer: bool = False) -> None:
+        with self.lock:
+            self.commit_buffer(footer)
+
+    def commit_buffer(self, footer: bool = False) -> None:
+        sync = self.durability != "none"
+        if self.buffer and self.handler is not None:
+            self.handler.acquire()  # the lock of the handler, shared with the other records
+            try:
+                stream = self.handler.stream
+                stream.write("".join(self.buffer))
+                stream.flush()
+                if sync:
+                    os.fsync(stream.fileno())
+            finally:
+                self.handler.release()
+                self.buffer.clear()  # even on failure, so that a retry cannot duplicate the lines
+        if self.records or footer:
+            try:
+                self.logger.write_records(self.records, len(self.records), footer=footer, sync=sync)
+            finally:
+                self.records.clear()
+        if self.rows and self.logger.store is not None:
+            try:
+                self.logger.store.add_arcs(self.rows)
+            finally:
+                self.rows.clear()
+
+    def close(self) -> None:
+        """Commit the last group with a footer, and let the logger write directly again."""
+        self.commit(footer=True)
+        if self.logger.journal is self:
+            self.logger.journal = None
+
+
+def read_records(path: Path, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Read the structured records of a session backwards, without loading the whole file.
+
+    Yields:
+        The decoded records, from the last one. A record truncated by a crash is skipped.
+    """
+    with open(path, "rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        tail = b""
+        while position > 0:
+            size = min(chunk_size, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + tail).split(b"\n")
+            tail = lines.pop(0)  # possibly incomplete
+            for line in reversed(lines):
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        if tail:
+            try:
+                yield json.loads(tail)
+            except ValueError:
+                pass
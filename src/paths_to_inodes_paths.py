@@ -1,16 +1,26 @@
+import errno
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
 
 from src.user_errors import NoItemToRenameError
 from src.user_types import Inode, InodesPaths
 
 
-def paths_to_inodes_paths(paths: List[Path]) -> InodesPaths:
+def paths_to_inodes_paths(paths: Iterable[Path], threads: int = 1) -> InodesPaths:
     """
     Given a list of paths, return a mapping from inodes to paths.
 
     Args:
-        paths: list of Path objects
+        paths: list of Path objects, or any iterable of them. In the latter case, each path is
+            looked up as soon as it is provided (e.g., while a pipeline is still producing them).
+        threads: when greater than 1, the maximal number of threads calling `lstat()` at the same
+            time. This hides the latency of network-mounted storage. The paths are submitted by
+            windows of bounded size, and the result is the same as with a single thread.
 
     Raises:
         FileNotFoundError: if any of the paths does not exist.
@@ -21,11 +31,11 @@ def paths_to_inodes_paths(paths: List[Path]) -> InodesPaths:
     """
     result = {}
     missing_paths = []
-    for path in paths:
-        if path.exists():
-            result[Inode(path.stat().st_ino)] = path
-        else:
+    for (path, inode) in iter_inodes(paths, threads):
+        if inode is None:
             missing_paths.append(path)
+        else:
+            result[inode] = path
     if missing_paths:
         n = len(missing_paths)
         raise FileNotFoundError(f"{n} missing item{'s'[:n^1]}: {list(map(str,missing_paths))}.")
@@ -33,3 +43,175 @@ def paths_to_inodes_paths(paths: List[Path]) -> InodesPaths:
         raise NoItemToRenameError("No item to rename was provided.")
     else:
         return result
+
+
+def inode_or_none(path: Path) -> Optional[Inode]:
+    """Return the inode of a path, or `None` when it does not exist (like `Path.exists()`)."""
+    try:
+        return Inode(os.lstat(path).st_ino)  # a single system call per path
+    except (FileNotFoundError, NotADirectoryError):  # e.g., "setup.py/child"
+        return None
+    except OSError as e:
+        if e.errno == errno.ELOOP:  # too many levels of symbolic links
+            return None
+        raise
+
+
+def iter_inodes(
+    paths: Iterable[Path],
+    threads: int = 1,
+) -> Iterator[Tuple[Path, Optional[Inode]]]:
+    """Yield the given paths with their inodes, in order (`None` for a missing path)."""
+    if threads <= 1:
+        for path in paths:
+            yield (path, inode_or_none(path))
+        return
+    paths = iter(paths)
+    with ThreadPoolExecutor(threads) as executor:
+        while True:
+            window = list(islice(paths, threads * 64))  # bound the number of pending calls
+            if not window:
+                break
+            yield from zip(window, executor.map(inode_or_none, window))
+
+
+def iter_null_separated_paths(stream: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[Path]:
+    """
+    Yield the paths of a stream separated by null characters (e.g., the output of `find -print0`).
+
+    Each path is yielded as soon as its terminator is read, without waiting for the end of the
+    stream. Unlike a line-based list, the names containing newlines are supported. The bytes
+    which cannot be decoded are preserved as by `os.fsdecode()`.
+
+    Args:
+        stream: a binary stream, typically `sys.stdin.buffer`.
+        chunk_size: the maximal number of bytes read at once.
+    """
+    read = getattr(stream, "read1", stream.read)  # return what is available, without waiting more
+    tail = b""
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        (*names, tail) = (tail + chunk).split(b"\0")
+        for name in names:
+            if name:
+                yield Path(os.fsdecode(name))
+    if tail:  # the last path may lack its terminator
+        yield Path(os.fsdecode(tail))
+
+
+def directory_to_inodes_paths(
+    directory: Path,
+    max_depth: Optional[int] = 1,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    on_error: Optional[Callable[[OSError], Any]] = None,
+) -> InodesPaths:
+    """
+    Return a mapping from inodes to paths for a directory and its descendants.
+
+    Args:
+        directory: the Path of the directory.
+        max_depth: the depth of the deepest descendants to include, 1 for the children only, or
+            `None` for the whole tree.
+        include: if any, the patterns of the names of the descendants to include.
+        exclude: the patterns of the names of the descendants to exclude, along with their own
+            descendants.
+        on_error: called with the error of each subfolder which cannot be listed.
+
+    Raises:
+        FileNotFoundError: if the directory does not exist.
+        re.error: if a regular expression is invalid.
+
+    Returns:
+        A mapping from inodes to paths, starting with the directory itself.
+    """
+    return dict(walk_inodes_paths(directory, max_depth, include, exclude, on_error))
+
+
+def walk_inodes_paths(
+    directory: Path,
+    max_depth: Optional[int] = None,
+    include: Iterable[str] = (),
+    exclude: Iterable[str] = (),
+    on_error: Optional[Callable[[OSError], Any]] = None,
+) -> Iterator[Tuple[Inode, Path]]:
+    """
+    Yield the inodes and the paths of a directory and its descendants, one at a time.
+
+    The inodes of the descendants are provided by the listing of their parent (on POSIX,
+    `os.scandir()` reads them along with the names), which spares a `stat()` call per item. Only
+    the subdirectories of the directory being listed are held in memory, never the whole tree.
+    The symbolic links to directories are yielded, but not followed. Like `find -xdev`, the walk
+    does not descend into the folders of another device (e.g., mount points), whose inodes could
+    collide with those of the directory. Like `os.walk()`, it skips the subfolders which cannot be
+    listed (e.g., for lack of permission).
+
+    The names are filtered as soon as they are listed. An excluded item is skipped with all its
+    descendants. An item not included is skipped too, but its descendants are still walked. The
+    directory itself is always yielded.
+
+    Args:
+        directory: the Path of the directory.
+        max_depth: the depth of the deepest descendants to yield, or `None` for no limit.
+        include: the patterns of the names to yield. If empty, all the names are yielded.
+        exclude: the patterns of the names to skip, along with their descendants.
+        on_error: called with the error of each subfolder which cannot be listed.
+
+    Raises:
+        FileNotFoundError: if the directory does not exist.
+        PermissionError: if the directory itself cannot be listed.
+        re.error: if a regular expression is invalid.
+    """
+    is_included = compile_name_patterns(include)
+    is_excluded = compile_name_patterns(exclude)
+    stat = os.lstat(directory)
+    yield (Inode(stat.st_ino), directory)
+    stack = [(directory, 1)] if max_depth is None or max_depth > 0 else []
+    while stack:
+        (parent, depth) = stack.pop()
+        subdirectories = []
+        try:
+            entries = os.scandir(parent)
+        except OSError as e:
+            if parent == directory:
+                raise
+            if on_error is not None:
+                on_error(e)
+            continue
+        with entries:
+            for entry in entries:
+                if is_excluded is not None and is_excluded(entry.name):
+                    continue
+                path = parent / entry.name
+                if is_included is None or is_included(entry.name):
+                    yield (Inode(entry.inode()), path)
+                if (
+                    (max_depth is None or depth < max_depth)
+                    and entry.is_dir(follow_symlinks=False)
+                    and entry.stat(follow_symlinks=False).st_dev == stat.st_dev
+                ):
+                    subdirectories.append((path, depth + 1))
+        stack.extend(reversed(subdirectories))
+
+
+def compile_name_patterns(patterns: Iterable[str]) -> Optional[Callable[[str], Any]]:
+    """
+    Compile some name patterns into a single predicate, or return `None` if there is none.
+
+    A pattern is either a glob matching the whole name (e.g., `*.jpg`, see `fnmatch`), or a
+    regular expression searched in it when prefixed by `re:` (e.g., `re:^IMG_\\d+`).
+    """
+    regexes = []
+    for pattern in patterns:
+        if pattern.startswith("re:"):
+            regexes.append(pattern[3:])
+        else:
+            regexes.append(r"\A" + translate(pattern))
+    if not regexes:
+        return None
+    if len(regexes) == 1:
+        return re.compile(regexes[0]).search
+    searches = [re.compile(regex).search for regex in regexes]  # each may have global flags
+    return lambda name: any(search(name) for search in searches)
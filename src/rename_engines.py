@@ -0,0 +1,176 @@
+import ctypes
+import errno
+import os
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+RENAME_NOREPLACE = 1
+RENAME_EXCHANGE = 2
+
+
+class PathEngine:
+    """Rename each item by its full path (default engine)."""
+
+    def rename(self, source: Path, target: Path) -> None:
+        source.rename(target)
+
+    def exchange(self, source: Path, target: Path) -> None:
+        """Swap two siblings with three renamings, through a temporary name.
+
+        This is the fallback when no atomic exchange is available, e.g. when undoing a session
+        performed with the `renameat2` engine.
+        """
+        temporary = source.with_name(f"{source.name}.{os.getpid()}~")
+        while os.path.lexists(temporary):
+            temporary = temporary.with_name(f"{temporary.name}~")
+        self.rename(source, temporary)
+        self.rename(target, source)
+        self.rename(temporary, target)
+
+    def close(self) -> None:
+        pass
+
+
+class DirectoryHandleEngine(PathEngine):
+    """Rename each item by its name, relatively to a handle on its parent directory.
+
+    The kernel resolves the full path of a parent only when it is opened, instead of once per
+    renaming. The handles are kept in a LRU cache, whose size bounds the number of file descriptors
+    held simultaneously.
+
+    Notes:
+        A handle follows its directory when the latter is renamed, but the path it is cached under
+        does not. The handles of a renamed folder and of its descendants are thus evicted.
+    """
+
+    FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+
+    def __init__(self, max_handles: int = 64):
+        self.max_handles = max_handles
+        self.handles: OrderedDict[Path, int] = OrderedDict()
+
+    def handle(self, directory: Path) -> int:
+        """Return a file descriptor on the given directory, opening it if needed."""
+        fd = self.handles.get(directory)
+        if fd is not None:
+            self.handles.move_to_end(directory)
+            return fd
+        fd = os.open(directory, self.FLAGS)
+        self.handles[directory] = fd
+        if len(self.handles) > self.max_handles:
+            os.close(self.handles.popitem(last=False)[1])
+        return fd
+
+    def rename(self, source: Path, target: Path) -> None:
+        try:
+            os.rename(
+                source.name,
+                target.name,
+                src_dir_fd=self.handle(source.parent),
+                dst_dir_fd=self.handle(target.parent),
+            )
+        except OSError as e:  # report the full paths, as a path-based renaming would do
+            raise OSError(e.errno, e.strerror, str(source), None, str(target)) from None
+        self.evict(source)
+
+    def evict(self, folder: Path) -> None:
+        """Close the handles of a folder and of its descendants, if any."""
+        for directory in [d for d in self.handles if d == folder or folder in d.parents]:
+            os.close(self.handles.pop(directory))
+
+    def close(self) -> None:
+        """Close all the handles, e.g. at the end of a renaming session."""
+        while self.handles:
+            os.close(self.handles.popitem()[1])
+
+
+@lru_cache(maxsize=None)
+def load_renameat2() -> Optional[Any]:
+    """Return the `renameat2` function of the C library (Linux only), or `None` if unavailable."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        function = ctypes.CDLL(None, use_errno=True).renameat2  # glibc 2.28+
+    except (OSError, AttributeError):
+        return None
+    (c_int, c_char_p) = (ctypes.c_int, ctypes.c_char_p)
+    function.argtypes = [c_int, c_char_p, c_int, c_char_p, ctypes.c_uint]
+    function.restype = ctypes.c_int
+    return function
+
+
+class Renameat2Engine(DirectoryHandleEngine):
+    """Rename with the flags of `renameat2`, relatively to cached directory handles.
+
+    - Each renaming is made with `RENAME_NOREPLACE`: the kernel atomically refuses to clobber an
+        existing target, instead of relying on the planned state of the file system only.
+    - Each exchange is made with `RENAME_EXCHANGE`: two siblings are swapped in a single system
+        call, which allows the planner to execute a cycle without any temporary name.
+
+    On a file system which does not support these flags (`EINVAL`), or on an older kernel
+    (`ENOSYS`), the engine falls back on the renamings of its base class for the whole session.
+    """
+
+    def __init__(self, max_handles: int = 64):
+        super().__init__(max_handles)
+        self.renameat2 = load_renameat2()
+
+    def call(self, source: Path, target: Path, flags: int) -> bool:
+        """Call `renameat2`, and return `False` if the flags are not supported."""
+        if self.renameat2 is not None:
+            try:
+                result = self.renameat2(
+                    self.handle(source.parent),
+                    os.fsencode(source.name),
+                    self.handle(target.parent),
+                    os.fsencode(target.name),
+                    flags,
+                )
+            except OSError as e:
+                raise OSError(e.errno, e.strerror, str(source), None, str(target)) from None
+            if result == 0:
+                self.evict(source)
+                self.evict(target)
+                return True
+            code = ctypes.get_errno()
+            if code not in (errno.EINVAL, errno.ENOSYS):
+                raise OSError(code, os.strerror(code), str(source), None, str(target))
+            self.renameat2 = None
+        return False
+
+    def rename(self, source: Path, target: Path) -> None:
+        if not self.call(source, target, RENAME_NOREPLACE):
+            if os.path.lexists(target):
+                code = errno.EEXIST
+                raise OSError(code, os.strerror(code), str(source), None, str(target))
+            super().rename(source, target)
+
+    def exchange(self, source: Path, target: Path) -> None:
+        if not self.call(source, target, RENAME_EXCHANGE):
+            super().exchange(source, target)
+
+
+RENAME_ENGINES = ("path", "directory_handles", "renameat2")
+
+
+def make_rename_engine(name: str):
+    """Return the engine of the given name, or the best supported approximation of it.
+
+    Raises:
+        ValueError: the engine is unknown.
+    """
+    if name not in RENAME_ENGINES:
+        raise ValueError(f"Unknown rename engine '{name}'.")
+    if name == "renameat2" and load_renameat2() is not None:
+        return Renameat2Engine()
+    if name in ("directory_handles", "renameat2") and os.rename in os.supports_dir_fd:
+        return DirectoryHandleEngine()
+    return PathEngine()
+
+
+def supports_exchanges(name: str) -> bool:
+    """Tell whether the engine of the given name can swap two siblings atomically."""
+    return name == "renameat2" and load_renameat2() is not None
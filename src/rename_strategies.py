@@ -0,0 +1,228 @@
+import errno
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Type
+
+from src.context import Context
+from src.git_index import InProcessIndexBatch, IndexBatch, repository_root
+from src.rename_engines import RENAME_ENGINES, PathEngine, make_rename_engine, supports_exchanges
+from src.user_types import Arc, ExchangeArc
+
+
+class ArcResult(NamedTuple):
+    arc: Arc
+    flags: str  # the prefix of the log line, e.g. "git:" or "exchange:"
+    error: Optional[Exception] = None
+
+
+class RenameStrategy(ABC):
+    """Perform the renamings of batches of arcs (base class of the strategies).
+
+    A batch consists of arcs to execute in order, typically the renamings of a given folder. It may
+    be an iterator fed by the planner: a strategy needing the whole batch beforehand must make a
+    list of it. The results are yielded one by one as soon as they are final, so that each
+    completed renaming can be logged before the next one is performed. The batch stops at the
+    first failure, whose result holds the error.
+
+    A strategy may be called by several threads at the same time, each with its own batch, and
+    has its state written by `flush()` once all the batches of a session are done. Each thread has
+    its own engine, which is kept from one batch to the next (e.g., with its cache of directory
+    handles), and closed by `flush()`. Any subclass registered in `RENAME_STRATEGIES` can be
+    selected with the setting `"rename_strategy"`.
+    """
+
+    def __init__(self, context: Context):
+        self.context = context
+        self.engine_name = context.config.get("rename_engine", "path")
+        if self.engine_name not in RENAME_ENGINES:  # fail before any renaming
+            raise ValueError(f"Unknown rename engine '{self.engine_name}'.")
+        self.local = threading.local()  # the engine of each thread
+        self.engines: List[PathEngine] = []  # the engines of all the threads, to close them
+        self.engines_lock = threading.Lock()
+
+    def engine(self) -> PathEngine:
+        """Return the engine of the current thread, creating it if needed."""
+        engine = getattr(self.local, "engine", None)
+        if engine is None:
+            engine = self.local.engine = make_rename_engine(self.engine_name)
+            with self.engines_lock:
+                self.engines.append(engine)
+        return engine
+
+    def supports_exchanges(self) -> bool:
+        """Tell whether an `ExchangeArc` is performed atomically, which the planner may exploit."""
+        return supports_exchanges(self.engine_name)
+
+    def rename_batch(self, arcs: Iterable[Arc]) -> Iterator[ArcResult]:
+        engine = self.engine()
+        for arc in arcs:
+            try:
+                flags = self.rename_one(arc, engine)
+            except Exception as e:
+                yield ArcResult(arc, "", e)
+                return
+            yield ArcResult(arc, flags)
+
+    @abstractmethod
+    def rename_one(self, arc: Arc, engine: PathEngine) -> str:
+        """Rename a single arc, and return the flags to log."""
+
+    def flush(self) -> None:
+        """Close the engines of all the threads. A subclass writing its own state must extend it."""
+        with self.engines_lock:
+            (engines, self.engines) = (self.engines, [])
+            self.local = threading.local()
+        for engine in engines:
+            engine.close()
+
+
+class PlainStrategy(RenameStrategy):
+    """Rename the items without any further bookkeeping."""
+
+    def rename_one(self, arc: Arc, engine: PathEngine) -> str:
+        if isinstance(arc, ExchangeArc):
+            engine.exchange(arc.source, arc.target)
+            return "exchange:"
+        engine.rename(arc.source, arc.target)
+        return ""
+
+
+class Renameat2Strategy(PlainStrategy):
+    """Same as `PlainStrategy`, with the `renameat2` engine whatever the `"rename_engine"`."""
+
+    def __init__(self, context: Context):
+        super().__init__(context)
+        self.engine_name = "renameat2"
+
+
+class GitStrategy(PlainStrategy):
+    """Rename the items and, if tracked, batch their renaming in the git index (default strategy).
+
+    The renamings themselves are immediate. An untracked file requires no git process at all. For
+    each repository, the updates of the index are only simulated, and written at once by `flush()`.
+    If git is not installed, the items are renamed without git for the rest of the session.
+    """
+
+    def __init__(self, context: Context):
+        super().__init__(context)
+        self.logger = context.logger
+        self.git_installed = True
+        self.repository_roots: Dict[Path, Optional[Path]] = {}  # folder -> root (if any)
+        self.index_batches: Dict[Path, IndexBatch] = {}  # root -> tracked files of the session
+        if context.config.get("git_index", "subprocess") == "in-process":
+            self.index_batch_class = InProcessIndexBatch
+        else:
+            self.index_batch_class = IndexBatch
+        self.lock = threading.Lock()  # serialize the git bookkeeping of the threads
+
+    def rename_one(self, arc: Arc, engine: PathEngine) -> str:
+        (source, target) = arc
+        batch = None
+        with self.lock:
+            if self.git_installed:
+                try:
+                    batch = self.get_index_batch(source.parent)
+                except FileNotFoundError:
+                    self.git_installed = False
+                    self.logger.warning("Git is not installed. Falling back to a non-git strategy.")
+        flags = super().rename_one(arc, engine)
+        if batch is None:
+            return flags
+        with self.lock:
+            if isinstance(arc, ExchangeArc):
+                tracked = batch.exchange(source, target)
+            else:
+                tracked = batch.move(source, target)
+        return f"git:{flags}" if tracked else flags
+
+    def get_index_batch(self, directory: Path) -> Optional[IndexBatch]:
+        """Return the batch of the repository containing a given directory, if any.
+
+        Raises:
+            FileNotFoundError: git is not installed.
+        """
+        root = repository_root(directory, self.repository_roots)
+        if root is None:
+            return None
+        if root not in self.index_batches:
+            try:
+                self.index_batches[root] = self.index_batch_class(root)
+            except FileNotFoundError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"Error while reading the git index of '{root}': {e}.")
+                self.repository_roots[directory] = None
+                return None
+        return self.index_batches[root]
+
+    def flush(self) -> None:
+        """Write the pending renamings in the index of each repository (one call per repository)."""
+        super().flush()
+        for batch in self.index_batches.values():
+            try:
+                batch.flush()
+            except Exception as e:
+                self.logger.warning(f"Error while updating the git index of '{batch.root}': {e}.")
+
+
+class DryRunStrategy(RenameStrategy):
+    """Simulate the renamings, and check them against the file system without changing anything.
+
+    The arcs are logged with a `dry-run:` flag, which makes them ignored by the undoing. Note that
+    a dry run is still a session of its own: just after it, undoing the previous session does
+    nothing, and the last real renamings are undone by undoing the last two sessions.
+    """
+
+    def __init__(self, context: Context):
+        super().__init__(context)
+        self.present: Set[Path] = set()  # the targets of the simulated renamings
+        self.absent: Set[Path] = set()  # their sources
+        self.lock = threading.Lock()
+
+    def supports_exchanges(self) -> bool:
+        return False
+
+    def exists(self, path: Path) -> bool:
+        return path in self.present or (path not in self.absent and os.path.lexists(path))
+
+    def rename_one(self, arc: Arc, engine: PathEngine) -> str:
+        (source, target) = arc
+        with self.lock:
+            if not self.exists(source):
+                code = errno.ENOENT
+                raise OSError(code, os.strerror(code), str(source), None, str(target))
+            if isinstance(arc, ExchangeArc):
+                if not self.exists(target):
+                    code = errno.ENOENT
+                    raise OSError(code, os.strerror(code), str(source), None, str(target))
+                return "dry-run:exchange:"
+            if self.exists(target):
+                code = errno.EEXIST
+                raise OSError(code, os.strerror(code), str(source), None, str(target))
+            self.present.discard(source)
+            self.absent.add(source)
+            self.absent.discard(target)
+            self.present.add(target)
+        return "dry-run:"
+
+
+RENAME_STRATEGIES: Dict[str, Type[RenameStrategy]] = {
+    "git": GitStrategy,
+    "plain": PlainStrategy,
+    "renameat2": Renameat2Strategy,
+    "dry-run": DryRunStrategy,
+}
+
+
+def make_rename_strategy(context: Context) -> RenameStrategy:
+    """Return the strategy selected by the setting `"rename_strategy"`.
+
+    Raises:
+        ValueError: the strategy, or its engine, is unknown.
+    """
+    name = context.config.get("rename_strategy", "git")
+    if name not in RENAME_STRATEGIES:
+        raise ValueError(f"Unknown rename strategy '{name}'.")
+    return RENAME_STRATEGIES[name](context)
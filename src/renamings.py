@@ -1,18 +1,30 @@
 import re
-import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import closing
+from itertools import groupby
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List
 
 from src.context import Context
+from src.logger import read_records
+from src.rename_strategies import make_rename_strategy
+from src.session_store import Row
 from src.user_errors import RecoverableRenamingError
-from src.user_types import Arc
+from src.user_types import Arc, ExchangeArc
 
 
 class Renamer:
     def __init__(self, context: Context, testing: bool = False):
         self.logger = context.logger
         self.print_ = context.print_
-        self.rename_one_file = self._rename_one_file_with_git  # set the default renaming strategy
+        self.strategy = make_rename_strategy(context)
+        self.renaming_threads = context.config.get("renaming_threads", 1)
+        if self.strategy.supports_exchanges():
+            self.planner = "exchanges"  # the cycles will be executed without any temporary name
+        else:
+            self.planner = context.config.get("planner", "greedy")
+        self.lock = threading.Lock()  # serialize the logging of the threads
         if testing:
             self.logger.create_new_log_file()
 
@@ -24,17 +36,28 @@ class Renamer:
         Args:
             arcs: list of couples (source_path, target_path)
         """
-        n = len(arcs)
-        self.print_(f"Renaming {n} items...")
-        self.logger.info(f"{n} item{'s'[:n^1]} to rename.")
+        n = self.start_renamings(len(arcs))
         try:
             self.rename_and_log_all_files(arcs)
-            self.logger.info(f"{n} item{'s'[:n^1]} renamed.")
-            self.print_(f"{n} item{'s'[:n^1]} renamed.")
-            return n
         except Exception as e:
-            self.logger.warning(f"perform_renamings: {e}")
-            raise RecoverableRenamingError(f"{e}.")
+            raise self.renamings_failed("perform_renamings", e)
+        return self.end_renamings(n)
+
+    def perform_streamed_renamings(self, arcs: Iterable[Arc]) -> int:
+        """
+        Same as `perform_renamings()`, but consume the arcs as they are produced, e.g. by
+        `iter_secure_clauses()`, so that the first renaming occurs before the last one is known.
+
+        Args:
+            arcs: iterable of couples (source_path, target_path)
+        """
+        self.print_("Renaming items...")
+        self.logger.info("Streaming the items to rename.")
+        try:
+            n = self.rename_and_log_all_files(arcs)
+        except Exception as e:
+            raise self.renamings_failed("perform_streamed_renamings", e)
+        return self.end_renamings(n)
 
     def rollback_renamings(self) -> int:
         """
@@ -42,83 +65,191 @@ class Renamer:
 
         Note: the inverse renamings are appended to the log file.
         """
-        n = len(self.arcs_to_rollback)
-        self.print_(f"Rolling back the first {n} renaming{'s'[:n^1]}...")
-        self.logger.info(f"{n} renaming{'s'[:n^1]} to roll back.")
+        arcs_to_rollback = self.start_rollback()
         try:
-            self.rename_and_log_all_files(self.arcs_to_rollback)
-            self.logger.info(f"{n} renaming{'s'[:n^1]} rolled back.")
-            return n
+            self.rename_and_log_all_files(arcs_to_rollback)
         except Exception as e:
             self.logger.error(f"rollback_renamings: {e}")
             raise
+        return self.end_rollback(len(arcs_to_rollback))
+
+    # The following steps are shared with `AsyncRenamer`, which only changes the way to run them.
+
+    def start_renamings(self, n: int) -> int:
+        self.print_(f"Renaming {n} items...")
+        self.logger.info(f"{n} item{'s'[:n^1]} to rename.")
+        return n
+
+    def end_renamings(self, n: int) -> int:
+        self.logger.info(f"{n} item{'s'[:n^1]} renamed.")
+        self.print_(f"{n} item{'s'[:n^1]} renamed.")
+        return n
+
+    def renamings_failed(self, step: str, error: Exception) -> RecoverableRenamingError:
+        """Log the failure of some renamings, and return the error to raise to roll them back."""
+        self.logger.warning(f"{step}: {error}")
+        return RecoverableRenamingError(f"{error}.")
+
+    def start_rollback(self) -> List[Arc]:
+        """Return the inverses of the completed renamings, in the order to perform them."""
+        arcs_to_rollback = [type(arc)(arc.target, arc.source) for arc in reversed(self.completed)]
+        n = len(arcs_to_rollback)
+        self.print_(f"Rolling back the first {n} renaming{'s'[:n^1]}...")
+        self.logger.info(f"{n} renaming{'s'[:n^1]} to roll back.")
+        return arcs_to_rollback
+
+    def end_rollback(self, n: int) -> int:
+        self.logger.info(f"{n} renaming{'s'[:n^1]} rolled back.")
+        return n
+
+    def open_session(self) -> None:
+        """Start keeping track of the completed renamings, and journaling them."""
+        self.completed: List[Arc] = []
+        self.journal = self.logger.open_journal()
+
+    def close_session(self) -> None:
+        """Write what remains of the journal and of the state of the strategy, even on failure."""
+        self.journal.close()
+        self.strategy.flush()
+
+    def print_completed(self) -> int:
+        self.print_arcs(self.completed)
+        self.print_.newline()
+        return len(self.completed)
 
     def get_arcs_for_undoing(
         self,
         previous_log_text: str,
-        get_logged_arcs=re.compile(r"(?m)^\w+:\w+:SOURCE:(.+)\tTARGET:(.+)").findall,
+        get_logged_arcs=re.compile(
+            r"(?m)^\w+:\w+:(?:git:)?(exchange:)?SOURCE:(.+)\tTARGET:(.+)"
+        ).findall,
     ):
         """Read a log file and calculate the reversed renamings."""
         if re.search(r"(?m)^ERROR:", previous_log_text):  # The log file contains an error.
             raise ValueError("The previous rollback failed. Undoing is not possible.")
         arcs = []
-        for (source, target) in reversed(get_logged_arcs(previous_log_text)):
-            arcs.append(Arc(Path(target), Path(source)))
+        for (exchange, source, target) in reversed(get_logged_arcs(previous_log_text)):
+            arcs.append((ExchangeArc if exchange else Arc)(Path(target), Path(source)))
         return arcs
 
-    def rename_and_log_all_files(self, arcs: List[Arc]):
-        self.arcs_to_rollback: List[Arc] = []
-        for (source, target) in arcs:
-            git_flag = self.rename_one_file(source, target)
-            self.logger.info(f"{'git:' if git_flag else ''}SOURCE:{source}\tTARGET:{target}")
-            self.arcs_to_rollback.insert(0, Arc(target, source))
-        self.print_arcs(arcs)
-        self.print_.newline()
+    def get_arcs_for_undoing_previous_session(self) -> List[Arc]:
+        """Calculate the reversed renamings of the previous session.
 
-    def _rename_one_file_with_git(self, source: Path, target: Path) -> bool:
-        """Try to use git to operate a renaming (default strategy for `rename_one_file()`).
+        Its structured records are preferred. The text of its log is only read for a session
+        recorded before their introduction.
+        """
+        if self.logger.previous_records_path.is_file():
+            return self.get_arcs_for_undoing_records(self.logger.previous_records_path)
+        return self.get_arcs_for_undoing(self.logger.get_previous_contents())
 
-        Args:
-            source (Path): the path to the file to rename
-            target (Path): the new path to the file
+    def get_arcs_for_undoing_records(self, path: Path) -> List[Arc]:
+        """Read the structured records of a session backwards, and calculate the reversed renamings.
+
+        The last footer tells at once whether the session has an error. When the session has been
+        interrupted before writing it, the errors are searched among all the records instead.
+        """
+        arcs = []
+        for record in read_records(path):
+            if isinstance(record, dict):
+                if record.get("errors") or "error" in record:
+                    raise ValueError("The previous rollback failed. Undoing is not possible.")
+                continue
+            arcs.extend(undoing_arcs([record]))
+        return arcs
+
+    def get_arcs_for_undoing_sessions(self, n: int) -> List[Arc]:
+        """Calculate the reversed renamings of the last `n` sessions, from the session store.
+
+        Raises:
+            ValueError: the rollback of one of these sessions failed.
+        """
+        store = self.logger.store
+        arcs: List[Arc] = []
+        for session in store.last_sessions(n):
+            (errors, rows) = store.session_arcs(session)
+            if errors:
+                message = f"The rollback of session {session} failed. Undoing is not possible."
+                raise ValueError(message)
+            arcs.extend(undoing_arcs(reversed(rows)))
+        return arcs
+
+    def rename_and_log_all_files(self, arcs: Iterable[Arc]) -> int:
+        """Rename and log the given arcs, keeping track of the completed ones for rolling back.
 
-        Returns:
-            bool: `True` if the renaming was done using git, `False` otherwise. In the latter case,
-                the renaming is done without git, as well as all the subsequent ones.
+        The arcs are passed to the strategy by batches of consecutive siblings, or of independent
+        groups when several threads are allowed.
         """
+        self.open_session()
         try:
-            subprocess.run(
-                [
-                    "git",
-                    "-C",  # Run git as if it was started...
-                    source.parent,  #  ... from the source's parent directory.
-                    "mv",
-                    source.name,
-                    target.name,
-                ],
-                check=True,
-                stderr=subprocess.DEVNULL,
-            )
-            return True
-        except FileNotFoundError:
-            self.rename_one_file = self._rename_one_file
-            self.logger.warning(f"Git is not installed. Falling back to a non-git strategy.")
-        except subprocess.CalledProcessError:
-            pass
-        except Exception as e:
-            self.logger.warning(f"Error while git-renaming '{source}' to '{target}': {e}.")
-        return self._rename_one_file(source, target)
+            if self.renaming_threads > 1:
+                self.rename_and_log_in_parallel(arcs)
+            else:
+                for (_, group) in groupby(arcs, key=lambda arc: arc.source.parent):
+                    self.rename_and_log_group(group)  # still consumed lazily
+        finally:  # even on failure, the log and the index must reflect the completed renamings
+            self.close_session()
+        return self.print_completed()
+
+    def rename_and_log_in_parallel(self, arcs: Iterable[Arc]) -> None:
+        """Rename the independent arcs in a pool of threads, e.g. on network-mounted storage.
+
+        Each level (see `independent_groups()`) is completed before the next one starts, and each
+        of its groups is executed in order by a single thread. The log may thus interleave the
+        groups, but undoing it in reverse order is still safe.
+
+        Raises:
+            The error of the first failing group, once all the groups of its level are done.
+        """
+        with ThreadPoolExecutor(self.renaming_threads) as executor:
+            for groups in independent_groups(arcs):
+                futures = [executor.submit(self.rename_and_log_group, group) for group in groups]
+                wait(futures)
+                for future in futures:
+                    future.result()
+
+    def rename_and_log_group(self, arcs: Iterable[Arc]) -> None:
+        """Rename a batch of arcs with the strategy, and log each of them as soon as completed.
 
-    def _rename_one_file(self, source: Path, target: Path) -> bool:
-        """Fallback strategy as soon as a git-renaming has found that git was not installed."""
-        source.rename(target)
-        return False
+        Raises:
+            The error of the first failing arc, if any.
+        """
+        with closing(self.strategy.rename_batch(arcs)) as results:
+            for (arc, flags, error) in results:
+                if error is not None:
+                    raise error
+                with self.lock:  # the log and `self.completed` are kept in the same order
+                    self.completed.append(arc)  # first: a failing journal must not hide it
+                    self.journal.append(flags, arc)
 
     def print_arcs(self, arcs: List[Arc]):
         previous_parent = Path()
-        for (source, target) in arcs:
+        for arc in arcs:
+            (source, target) = arc
             if source.parent != previous_parent:
                 self.print_.newline()
                 self.print_(f"{source.parent}")
                 previous_parent = source.parent
-            self.print_(f"{source.name} -> {target.name}")
+            arrow = "<->" if isinstance(arc, ExchangeArc) else "->"
+            self.print_(f"{source.name} {arrow} {target.name}")
+
+
+def undoing_arcs(rows: Iterable[Row]) -> Iterator[Arc]:
+    """Reverse the logged arcs `(flags, source, target)`, except those never performed."""
+    for (flags, source, target) in rows:
+        if flags.replace("git:", "").replace("exchange:", ""):  # e.g., "dry-run:"
+            continue
+        yield (ExchangeArc if "exchange:" in flags else Arc)(Path(target), Path(source))
+
+
+def independent_groups(arcs: Iterable[Arc]) -> Iterator[List[List[Arc]]]:
+    """Consume the arcs level by level, and yield the groups of each level that can run together.
+
+    Inside a level, the arcs are grouped by parent: two arcs with distinct parents and the same
+    depth cannot interfere, since none of their paths is an ancestor of the other ones. The order
+    of the arcs is kept inside each group.
+    """
+    for (_, level_arcs) in groupby(arcs, key=lambda arc: len(arc.source.parts)):
+        groups: Dict[Path, List[Arc]] = {}
+        for arc in level_arcs:
+            groups.setdefault(arc.source.parent, []).append(arc)
+        yield list(groups.values())
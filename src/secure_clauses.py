@@ -1,12 +1,19 @@
-from itertools import groupby
-from typing import Iterable, List, Tuple
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, repeat
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Tuple
 
 from src.file_system import FileSystem
 from src.user_errors import DuplicatedClauseError, SeveralSourcesError, SeveralTargetsError
-from src.user_types import Arc, Clause, ClauseMap, Name
+from src.user_types import Arc, Clause, ClauseMap, ExchangeArc, ExchangeClause, Name
 
 
-def secure_clauses(file_system: FileSystem, clauses: List[Clause]) -> List[Arc]:
+def secure_clauses(
+    file_system: FileSystem,
+    clauses: List[Clause],
+    planner: str = "greedy",
+) -> List[Arc]:
     """Construct a "safe" version of the given renaming clauses and update the file system.
 
     The resulting sequence is a reordered copy of the given clauses, with potentially the
@@ -21,9 +28,18 @@ def secure_clauses(file_system: FileSystem, clauses: List[Clause]) -> List[Arc]:
             - empty: the arborescence will be populated by calling `update_with_source_paths()`
                 with a list of source paths: this method will add not only the given paths, but
                 their actual siblings too.
+            - empty and lazy: only the source paths, and then the targets and the temporary names
+                needed to secure the clauses, are probed in the actual file system.
             - nonempty: used with a prepopulated test file system, like `test/fhs.txt`.
+        planner (str): The way the clauses of a given level are secured (see `PLANNERS`):
+            - "greedy": any clause whose target exists is diverted through a temporary name.
+            - "cycles": the renamings of each folder are decomposed into chains, which are
+                executed backwards, and cycles, which need exactly one temporary name each.
+            - "exchanges": same as "cycles", but each cycle of length k is executed as k - 1
+                exchanges, which requires no temporary name (see `ExchangeArc`).
 
     Raises:
+        ValueError: when the planner is unknown.
         SeveralTargetsError: when two distinct renaming targets are specified for the same source.
         SeveralSourcesError: when two distinct sources have the same renaming target, or when a
             renaming target already exists and has no specified renaming.
@@ -37,27 +53,220 @@ def secure_clauses(file_system: FileSystem, clauses: List[Clause]) -> List[Arc]:
         List[Arc]: A "safe" version of the given renaming clauses, presented as a list of
             source and target paths.
     """
+    return list(iter_secure_clauses(file_system, clauses, planner))
+
+
+def iter_secure_clauses(
+    file_system: FileSystem,
+    clauses: List[Clause],
+    planner: str = "greedy",
+) -> Iterator[Arc]:
+    """Same as `secure_clauses()`, but stream the resulting arcs level by level.
+
+    The clauses are checked before returning, so that any error is raised by the call itself. The
+    levels are then secured on demand, the most nested first, and the arcs of each level are
+    yielded as soon as it is final. Executing them before securing the next level is safe, since
+    they only affect the content of folders whose names are not planned yet.
+    """
+    if planner not in PLANNERS:
+        raise ValueError(f"Unknown planner '{planner}'.")
     clause_dict = dict_of_clauses(clauses)
     try:
         file_system.update_with_source_paths(clause_dict.keys())
     except FileNotFoundError as e:
         raise FileNotFoundError(f"File not found: '{e}'.")
     check_injectivity(file_system, clause_dict)
-    clauses_by_levels = sorted_by_level(clause_dict)
-    safe_clauses = []
-    for (level, clauses) in clauses_by_levels:
+    secure_level = PLANNERS[planner]
+    return (
+        (ExchangeArc if isinstance(clause, ExchangeClause) else Arc)(
+            clause.path, clause.path.parent / clause.new_name
+        )
+        for (level, clauses) in sorted_by_level(clause_dict)
+        for clause in secure_level(file_system, clauses)
+    )
+
+
+def secure_clauses_in_parallel(
+    clauses: List[Clause],
+    workers: int,
+    file_system_factory: Callable[[], FileSystem] = FileSystem,
+    planner: str = "greedy",
+) -> List[Arc]:
+    """Construct a "safe" version of the given renaming clauses in a pool of processes.
+
+    The clauses whose paths have distinct parents never interact: their new paths are siblings of
+    distinct paths, and the most nested ones are executed first anyway. The clauses are thus
+    grouped by parent, and the groups are distributed into balanced shards. Each shard is secured
+    in its own process, with its own file system, and the resulting arcs are merged level by level.
+
+    Args:
+        clauses (List[Clause]): see `secure_clauses()`.
+        workers (int): the maximal number of processes.
+        file_system_factory (Callable[[], FileSystem]): a picklable callable creating the file
+            system of each shard, e.g. `FileSystem` itself or a `functools.partial` of it.
+        planner (str): see `secure_clauses()`.
+
+    Raises:
+        The same exceptions as `secure_clauses()`.
+
+    Returns:
+        List[Arc]: the arcs of all shards, with the most nested first.
+    """
+    groups: Dict[Path, List[Clause]] = {}
+    for (path, new_name) in dict_of_clauses(clauses).items():
+        groups.setdefault(path.parent, []).append(Clause(path, new_name))
+    shards: List[List[Clause]] = [[] for _ in range(min(workers, len(groups)))]
+    loads = [(0, i) for i in range(len(shards))]  # a heap of couples (size, shard index)
+    for group in sorted(groups.values(), key=len, reverse=True):
+        (load, i) = heapq.heappop(loads)
+        shards[i].extend(group)
+        heapq.heappush(loads, (load + len(group), i))
+    if len(shards) < 2:
+        return secure_clauses(file_system_factory(), clauses, planner)
+    with ProcessPoolExecutor(len(shards)) as executor:
+        results = executor.map(secure_shard, shards, repeat(file_system_factory), repeat(planner))
+        arcs_by_level: Dict[int, List[Arc]] = {}
+        for arcs in results:
+            for (level, level_arcs) in groupby(arcs, key=lambda arc: len(arc.source.parts)):
+                arcs_by_level.setdefault(level, []).extend(level_arcs)
+    return [arc for level in sorted(arcs_by_level, reverse=True) for arc in arcs_by_level[level]]
+
+
+def secure_shard(
+    clauses: List[Clause],
+    file_system_factory: Callable[[], FileSystem],
+    planner: str,
+) -> List[Arc]:
+    """Secure the clauses of a shard in a worker process (must be picklable, hence global)."""
+    return secure_clauses(file_system_factory(), clauses, planner)
+
+
+def secure_level_greedily(file_system: FileSystem, clauses: List[Clause]) -> List[Clause]:
+    """Secure the clauses of a given level by diverting each clash through a temporary name."""
+    i = 0
+    while i < len(clauses):  # `clauses` sequence may grow
+        (path, new_name) = clauses[i]
+        new_path = path.with_name(new_name)
+        if new_path in file_system:
+            new_path = file_system.non_existing_sibling(path)
+            clauses[i] = Clause(path, Name(new_path.name))
+            clauses.append(Clause(new_path, new_name))
+        file_system.rename(path, new_path)
+        file_system.temporary_names.release(path)
+        i += 1
+    return clauses
+
+
+def secure_level_by_cycles(
+    file_system: FileSystem,
+    clauses: List[Clause],
+    exchange: bool = False,
+) -> List[Clause]:
+    """Secure the clauses of a given level by decomposing their renaming graph.
+
+    Since the clauses are injective, each path has at most one successor (its new path) and one
+    predecessor. The graph is thus made of disjoint chains and cycles, all of them among siblings:
+
+    - A chain starts from a path which is not renamed into, and ends on a new path which does not
+        exist. It is executed backwards, from its end, without any intermediate renaming.
+    - A cycle is broken by renaming its first path into a temporary name. The others are then
+        executed backwards, and finally the temporary name into the new name of the first one.
+        The temporary name is released, and can be reused by the next cycle in the same folder.
+    - A null renaming is a cycle of length 1, and is dropped.
+
+    Args:
+        exchange (bool): if `True`, a cycle `p_0 -> p_1 -> ... -> p_(k-1) -> p_0` is rather
+            executed as the exchanges of `p_(k-2)` and `p_(k-1)`, ..., then of `p_0` and `p_1`,
+            without any temporary name.
+
+    Returns:
+        List[Clause]: the secured clauses, with exactly one intermediate renaming per cycle, or
+            none at all with exchanges.
+    """
+    successors = {path: path.with_name(new_name) for (path, new_name) in clauses}
+    predecessors = {new_path: path for (path, new_path) in successors.items()}
+    result: List[Clause] = []
+    visited: Set[Path] = set()
+
+    def emit(path: Path, new_path: Path):
+        file_system.rename(path, new_path)
+        result.append(Clause(path, Name(new_path.name)))
+
+    for head in successors:
+        if head in predecessors:  # not the start of a chain
+            continue
+        chain = []
+        path = head
+        while path in successors:
+            visited.add(path)
+            chain.append(path)
+            path = successors[path]
+        for path in reversed(chain):
+            emit(path, successors[path])
+
+    for first in successors:
+        if first in visited:
+            continue
+        cycle = []
+        path = first
+        while path not in visited:
+            visited.add(path)
+            cycle.append(path)
+            path = successors[path]
+        if len(cycle) == 1:  # null renaming
+            continue
+        if exchange:
+            for (path, new_path) in reversed(list(zip(cycle, cycle[1:]))):
+                file_system.exchange(path, new_path)
+                result.append(ExchangeClause(path, Name(new_path.name)))
+            continue
+        temporary_path = file_system.non_existing_sibling(first)
+        emit(first, temporary_path)
+        for path in reversed(cycle[1:]):
+            emit(path, successors[path])
+        emit(temporary_path, successors[first])
+        file_system.temporary_names.release(temporary_path)
+
+    return result
+
+
+def secure_level_by_exchanges(file_system: FileSystem, clauses: List[Clause]) -> List[Clause]:
+    """Same as `secure_level_by_cycles()`, but execute the cycles as exchanges."""
+    return secure_level_by_cycles(file_system, clauses, exchange=True)
+
+
+PLANNERS = {
+    "greedy": secure_level_greedily,
+    "cycles": secure_level_by_cycles,
+    "exchanges": secure_level_by_exchanges,
+}
+
+
+def count_greedy_arcs(clauses: List[Clause]) -> int:
+    """Count the arcs the greedy planner would produce for some valid clauses.
+
+    This simulation requires no file system, and serves to report the savings of another planner.
+    Indeed, the injectivity of the clauses guarantees that the only new paths which may exist are
+    the original paths of the same level.
+    """
+    result = 0
+    for (level, clauses) in sorted_by_level(dict_of_clauses(clauses)):
+        occupied: Set[Any] = {path for (path, _) in clauses}
+        arcs: List[Tuple[Any, Any]] = [
+            (path, path.with_name(new_name)) for (path, new_name) in clauses
+        ]
         i = 0
-        while i < len(clauses):  # `clauses` sequence may grow
-            (path, new_name) = clauses[i]
-            new_path = path.with_name(new_name)
-            if new_path in file_system:
-                new_path = file_system.non_existing_sibling(path)
-                clauses[i] = Clause(path, Name(new_path.name))
-                clauses.append(Clause(new_path, new_name))
-            file_system.rename(path, new_path)
+        while i < len(arcs):  # `arcs` sequence may grow
+            (path, new_path) = arcs[i]
+            if new_path in occupied:
+                temporary_path = object()  # distinct from anything else
+                arcs.append((temporary_path, new_path))
+                new_path = temporary_path
+            occupied.discard(path)
+            occupied.add(new_path)
             i += 1
-        safe_clauses.extend(clauses)
-    return [Arc(path, path.parent / new_name) for (path, new_name) in safe_clauses]
+        result += len(arcs)
+    return result
 
 
 def dict_of_clauses(clauses: Iterable[Clause]) -> ClauseMap:
@@ -106,6 +315,8 @@ def check_injectivity(file_system: FileSystem, clauses: ClauseMap):
     Raises:
         SeveralSourcesError: A resulting path has two distinct antecedents.
     """
+    sources = {path.with_name(new_name): path for (path, new_name) in clauses.items()}
+    file_system.probe(sources, sources)
     already_seen = set()
     for (path, new_name) in clauses.items():
         new_path = path.with_name(new_name)
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+Row = Tuple[str, str, str]  # the flags, the source and the target of a logged arc
+
+
+class SessionStore:
+    """Index the arcs of all the renaming sessions in a SQLite database.
+
+    Each session is numbered like its rotated log file (see `Logger.rotate_log_file()`). Its arcs
+    are inserted by the journal, one transaction per group, and indexed by path. This allows to
+    undo several sessions, and to find the last session involving a given path, without parsing
+    any log. The paths are stored as the bytes of the file system (see `os.fsencode()`), since a
+    name may not be valid UTF-8.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session INTEGER PRIMARY KEY,
+            errors INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS arcs (
+            session INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            flags TEXT NOT NULL,
+            source BLOB NOT NULL,
+            target BLOB NOT NULL,
+            PRIMARY KEY (session, position)
+        );
+        CREATE INDEX IF NOT EXISTS arcs_by_source ON arcs (source, session);
+        CREATE INDEX IF NOT EXISTS arcs_by_target ON arcs (target, session);
+    """
+
+    def __init__(self, path: Path, sync: bool = True):
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(f"PRAGMA synchronous = {'NORMAL' if sync else 'OFF'}")
+        self.connection.executescript(self.SCHEMA)
+        self.lock = threading.Lock()  # the connection is shared by the threads of the journal
+        self.session = 0
+        self.position = 0
+
+    def start_session(self, session: int) -> None:
+        """Record the arcs of the given session from now on, forgetting any older homonym."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM arcs WHERE session = ?", (session,))
+            self.connection.execute("INSERT OR REPLACE INTO sessions VALUES (?, 0)", (session,))
+            self.session = session
+            self.position = 0
+
+    def add_arcs(self, rows: Iterable[Row]) -> None:
+        """Append some arcs to the current session, in a single transaction."""
+        with self.lock, self.connection:
+            values = [
+                (self.session, self.position + i, flags, os.fsencode(source), os.fsencode(target))
+                for (i, (flags, source, target)) in enumerate(rows)
+            ]
+            self.connection.executemany("INSERT INTO arcs VALUES (?, ?, ?, ?, ?)", values)
+            self.position += len(values)
+
+    def add_error(self) -> None:
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE sessions SET errors = errors + 1 WHERE session = ?", (self.session,)
+            )
+
+    def last_sessions(self, n: int) -> List[int]:
+        """Return the numbers of the last `n` sessions before the current one, from the last.
+
+        Only the sessions having renamed something are counted: e.g., an aborted session, or one
+        showing the help, has nothing to undo.
+        """
+        if n < 1:  # SQLite would take a negative limit as no limit at all
+            return []
+        with self.lock:
+            cursor = self.connection.execute(
+                """
+                SELECT session FROM sessions AS s
+                WHERE session < ? AND EXISTS (SELECT 1 FROM arcs WHERE arcs.session = s.session)
+                ORDER BY session DESC LIMIT ?
+                """,
+                (self.session, n),
+            )
+            return [session for (session,) in cursor]
+
+    def session_arcs(self, session: int) -> Tuple[int, List[Row]]:
+        """Return the number of errors and the arcs of a given session, in their order."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT errors FROM sessions WHERE session = ?", (session,)
+            ).fetchone()
+            cursor = self.connection.execute(
+                "SELECT flags, source, target FROM arcs WHERE session = ? ORDER BY position",
+                (session,),
+            )
+            arcs = [
+                (flags, os.fsdecode(source), os.fsdecode(target))
+                for (flags, source, target) in cursor
+            ]
+            return (row[0] if row else 0, arcs)
+
+    def last_session_involving(self, path: Path) -> Optional[int]:
+        """Return the number of the last session having renamed a given path, or to it."""
+        with self.lock:
+            (session,) = self.connection.execute(
+                """
+                SELECT MAX(session) FROM (
+                    SELECT MAX(session) AS session FROM arcs WHERE source = ?
+                    UNION ALL
+                    SELECT MAX(session) FROM arcs WHERE target = ?
+                )
+                """,
+                (os.fsencode(path), os.fsencode(path)),
+            ).fetchone()
+            return session
+
+    def close(self) -> None:
+        self.connection.close()
@@ -1,9 +1,11 @@
+import os
 import subprocess
 import sys
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from functools import partial
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List, Dict, Any
+from typing import IO, Iterable, Dict, Any, Optional
 
 sys.path[0:0] = ["."]
 
@@ -12,11 +14,20 @@ from src.get_editable_text import get_editable_text
 from src.get_editor_command import get_editor_command
 from src.context import Context
 from src.parse_edited_text import parse_edited_text
-from src.paths_to_inodes_paths import paths_to_inodes_paths
+from src.paths_to_inodes_paths import (
+    directory_to_inodes_paths,
+    iter_null_separated_paths,
+    paths_to_inodes_paths,
+)
 from src.renamings import Renamer
-from src.secure_clauses import secure_clauses
+from src.secure_clauses import (
+    count_greedy_arcs,
+    iter_secure_clauses,
+    secure_clauses,
+    secure_clauses_in_parallel,
+)
 from src.user_errors import *
-from src.user_types import EditedText
+from src.user_types import Arc, EditedText
 
 
 def main():
@@ -26,21 +37,25 @@ def main():
     context.logger.info("Parsing arguments.")
     kwargs = cli_arguments()
     context.logger.info("Parsing arguments done.")
-    if kwargs["paths"]:
+    if kwargs["paths"] or kwargs["null"]:
         do_renamings(context, **kwargs)
     else:
-        undo_renamings(context)
+        undo_renamings(context, kwargs["undo"])
     context.logger.info("Exiting the program.")
 
 
-def undo_renamings(context: Context):
+def undo_renamings(context: Context, sessions: int = 1):
     logger = context.logger
     print_ = context.print_
     logger.info("Undoing renamings.")
-    renamer = Renamer(context)
     try:
-        arcs_for_undoing = renamer.get_arcs_for_undoing(logger.previous_log_contents)
-        opening = "The previous renaming session was undone."
+        renamer = Renamer(context)
+        if sessions == 1:
+            arcs_for_undoing = renamer.get_arcs_for_undoing_previous_session()
+            opening = "The previous renaming session was undone."
+        else:
+            arcs_for_undoing = renamer.get_arcs_for_undoing_sessions(sessions)
+            opening = f"The {sessions} previous renaming sessions were undone."
         closing = "Launch Suprenam again to restore."
         n = renamer.perform_renamings(arcs_for_undoing)
         if n == 0:
@@ -65,28 +80,44 @@ def do_renamings(context: Context, **kwargs):
     print_ = context.print_
     logger.info("Constructing the list of items to rename.")
 
-    paths: List[Path] = []
-    if len(kwargs["paths"]) > 1:
+    paths: Iterable[Path] = []
+    directory: Optional[Path] = None
+    max_depth: Optional[int] = 1
+    from_stdin = kwargs.get("null", False)
+    if from_stdin:
+        logger.info("The null-separated paths of the items are read from the standard input.")
+        paths = iter_null_separated_paths(sys.stdin.buffer)  # looked up as soon as they come
+    elif len(kwargs["paths"]) > 1:
         logger.info("The paths of several items to rename are provided.")
-        paths.extend(map(Path, kwargs["paths"]))
+        paths = list(map(Path, kwargs["paths"]))
     else:  # `do_renamings` cannot be called without at least one path. So there is exactly one.
         single_path = Path(kwargs["paths"][0])
         logger.info(f"A single path is provided: {single_path}.")
         if single_path.is_dir():
-            logger.info(f"It is a directory: it and its children are to be renamed.")
-            paths.append(single_path)
-            paths.extend(single_path.iterdir())
+            directory = single_path
+            max_depth = kwargs.get("max_depth")
+            if not kwargs.get("recursive") and max_depth is None:
+                max_depth = 1
+                logger.info(f"It is a directory: it and its children are to be renamed.")
+            else:
+                logger.info(f"It is a directory: it and its descendants are to be renamed.")
         elif single_path.is_file() and single_path.suffix == ".txt":
             logger.info(f"It is a text file containing the paths of the items to rename.")
-            paths.extend(map(Path, filter(None, single_path.read_text().splitlines())))
+            paths = list(map(Path, filter(None, single_path.read_text().splitlines())))
         else:
             logger.info(f"It is either a missing or a non-text file: default to rename it.")
-            paths.append(single_path)
+            paths = [single_path]
             # The case of a missing single file will be catched by `paths_to_inodes_paths()`.
 
     logger.info("Creating a mapping from inodes to paths.")
     try:
-        inodes_paths = paths_to_inodes_paths(paths)
+        if directory is None:
+            inodes_paths = paths_to_inodes_paths(paths, context.config.get("stat_threads", 1))
+        else:
+            include = context.config.get("include", []) + (kwargs.get("include") or [])
+            exclude = context.config.get("exclude", []) + (kwargs.get("exclude") or [])
+            skip = lambda e: logger.warning(f"Skipping a folder which cannot be listed: {e}.")
+            inodes_paths = directory_to_inodes_paths(directory, max_depth, include, exclude, skip)
         logger.info("Creating a mapping from inodes to paths done.")
     except Exception as e:
         return print_.abort(str(e))
@@ -114,7 +145,11 @@ def do_renamings(context: Context, **kwargs):
 
     logger.info("Opening the editable text file in the editor and waiting it to be closed.")
     try:
-        subprocess.run(editor_command, shell=True, check=True)
+        if from_stdin:  # the standard input is exhausted: give the terminal back to the editor
+            with open_terminal() as terminal:
+                subprocess.run(editor_command, shell=True, check=True, stdin=terminal)
+        else:
+            subprocess.run(editor_command, shell=True, check=True)
         logger.info("Command executed without process error.")
     except subprocess.CalledProcessError:
         return print_.abort(f"The command '{editor_command}' failed.")
@@ -134,16 +169,35 @@ def do_renamings(context: Context, **kwargs):
         return print_.abort(str(e))
 
     logger.info("Converting the clauses into a “safe” sequence of renamings.")
+    stream = context.config.get("stream_renamings", False)
     try:
-        arcs = secure_clauses(FileSystem(), clauses)
-        logger.info(f"Converted clauses into {len(arcs)} arcs.")
+        renamer = Renamer(context)
+        lazy = context.config.get("lazy_file_system", False)
+        planner = renamer.planner
+        workers = context.config.get("planning_processes", 1)
+        arcs: Iterable[Arc]
+        if stream:  # the arcs will be secured level by level while the renamings are performed
+            arcs = iter_secure_clauses(FileSystem(lazy=lazy), clauses, planner)
+            logger.info("Converted clauses into a stream of arcs.")
+        else:
+            if workers > 1:
+                factory = partial(FileSystem, lazy=lazy)
+                arcs = secure_clauses_in_parallel(clauses, workers, factory, planner)
+            else:
+                arcs = secure_clauses(FileSystem(lazy=lazy), clauses, planner)
+            logger.info(f"Converted clauses into {len(arcs)} arcs.")
+            if planner != "greedy":
+                saved = count_greedy_arcs(clauses) - len(arcs)
+                logger.info(f"The planner '{planner}' saved {saved} arcs over the greedy one.")
     except Exception as e:
         return print_.abort(str(e))
 
     logger.info("Performing the actual renamings.")
-    renamer = Renamer(context)
     try:
-        n = renamer.perform_renamings(arcs)
+        if stream:
+            n = renamer.perform_streamed_renamings(arcs)
+        else:
+            n = renamer.perform_renamings(list(arcs))
         if n == 0:
             print_.abort(f"Nothing was changed in the name list.")
         elif n == 1:
@@ -169,6 +223,14 @@ def do_renamings(context: Context, **kwargs):
             )
 
 
+def open_terminal() -> IO:
+    """Open the controlling terminal for reading, or the null device if there is none."""
+    try:
+        return open("CON" if sys.platform == "win32" else "/dev/tty")
+    except OSError:
+        return open(os.devnull)
+
+
 def cli_arguments() -> Dict[str, Any]:
     """
     CLI argument parser.
@@ -187,7 +249,52 @@ def cli_arguments() -> Dict[str, Any]:
             "or a directory whose children are to be renamed"
         ),
     )
-    return vars(parser.parse_args())
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="read the paths of the items to rename from the standard input, separated by nulls",
+    )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="when a directory is provided, rename all its descendants instead of its children",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        metavar="N",
+        help="when a directory is provided, rename its descendants down to this depth (implies -r)",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="PATTERN",
+        help=(
+            "when a directory is provided, rename only the descendants whose name matches this "
+            "glob, or this regular expression if prefixed by 're:' (repeatable)"
+        ),
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="PATTERN",
+        help="same, but skip the matching descendants, and the descendants of these (repeatable)",
+    )
+    parser.add_argument(
+        "--undo",
+        type=int,
+        default=1,
+        metavar="N",
+        help="when no item is provided, the number of previous sessions to undo (default: 1)",
+    )
+    arguments = parser.parse_args()
+    if arguments.null and arguments.paths:
+        parser.error("no path can be provided along with -0")
+    if arguments.undo < 1:
+        parser.error("the number of sessions to undo must be at least 1")
+    return vars(arguments)
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -12,11 +12,19 @@ class Clause(NamedTuple):
 ClauseMap = Dict[Path, Name]
 
 
+class ExchangeClause(Clause):
+    """A clause whose path and new path are swapped at once with their sibling."""
+
+
 class Arc(NamedTuple):
     source: Path
     target: Path
 
 
+class ExchangeArc(Arc):
+    """An arc whose source and target are atomically swapped (a self-inverse operation)."""
+
+
 Inode = NewType("Inode", int)
 
 InodesPaths = Dict[Inode, Path]
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.async_api import *
+from src.context import Context
+from src.user_types import ExchangeArc
+
+context = Context("mockOS")
+logger = context.logger
+
+
+@pytest.fixture()
+def renamer():
+    logger.create_new_log_file()
+    return AsyncRenamer(context, concurrency=2)
+
+
+def test_scan_and_inodes(tmp_path, renamer, monkeypatch):
+    for name in ["foo", "bar.jpg", "baz/qux.jpg"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    paths = [tmp_path, tmp_path / "bar.jpg", tmp_path / "baz", tmp_path / "foo"]
+    result = asyncio.run(renamer.scan(tmp_path))
+    assert result == {os.stat(path).st_ino: path for path in paths}
+    assert asyncio.run(renamer.paths_to_inodes_paths(paths)) == result
+    foo = tmp_path / "foo"
+    assert asyncio.run(renamer.scan(foo)) == {os.stat(foo).st_ino: foo}
+    monkeypatch.setitem(context.config, "include", ["*.jpg"])  # like `do_renamings()`
+    result = asyncio.run(renamer.scan(tmp_path, max_depth=None))
+    assert sorted(result.values()) == [tmp_path, tmp_path / "bar.jpg", tmp_path / "baz/qux.jpg"]
+
+
+def test_secure_clauses_with_exchanges(tmp_path, monkeypatch):
+    monkeypatch.setitem(context.config, "rename_strategy", "renameat2")
+    renamer = AsyncRenamer(context)
+    if not renamer.renamer.strategy.supports_exchanges():
+        pytest.skip("renameat2 is not available")
+    for name in "ab":
+        (tmp_path / name).touch()
+    clauses = [Clause(tmp_path / "a", "b"), Clause(tmp_path / "b", "a")]
+    arcs = asyncio.run(renamer.secure_clauses(clauses))
+    assert [type(arc) for arc in arcs] == [ExchangeArc]
+
+
+def test_inodes_errors(tmp_path, renamer):
+    with pytest.raises(FileNotFoundError, match="1 missing item: "):
+        asyncio.run(renamer.paths_to_inodes_paths([tmp_path, tmp_path / "missing"]))
+    with pytest.raises(NoItemToRenameError):
+        asyncio.run(renamer.paths_to_inodes_paths([]))
+
+
+def test_concurrency_limit(renamer):
+    (in_flight, peak, lock) = ([0], [0], threading.Lock())
+
+    def work():
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+
+    async def main():
+        ticks = 0
+        tasks = asyncio.gather(*(renamer.run(work) for _ in range(8)))
+        while not tasks.done():  # the loop is not blocked meanwhile
+            ticks += 1
+            await asyncio.sleep(0)
+        return ticks
+
+    assert asyncio.run(main()) > 0
+    assert peak[0] <= 2
+
+
+def test_rename(tmp_path, renamer):
+    for name in ["a/x", "a/y", "b/x"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(name)
+    clauses = [
+        Clause(tmp_path / "a" / "x", "y"),  # a swap
+        Clause(tmp_path / "a" / "y", "x"),
+        Clause(tmp_path / "b" / "x", "z"),
+        Clause(tmp_path / "b", "c"),
+    ]
+    assert asyncio.run(renamer.rename(clauses)) == 5  # with a temporary name
+    assert (tmp_path / "a" / "x").read_text() == "a/y"
+    assert (tmp_path / "a" / "y").read_text() == "a/x"
+    assert (tmp_path / "c" / "z").read_text() == "b/x"
+    assert logger.get_contents().split("\n")[-1] == "INFO:root:5 items renamed."
+
+
+def test_rename_fail_and_rollback(tmp_path, renamer):
+    for name in "abc":
+        (tmp_path / name).touch()
+    arcs = [
+        Arc(tmp_path / "a", tmp_path / "d"),
+        Arc(tmp_path / "missing", tmp_path / "e"),
+        Arc(tmp_path / "b", tmp_path / "f"),
+    ]
+    with pytest.raises(RecoverableRenamingError):
+        asyncio.run(renamer.perform_renamings(arcs))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b", "c", "d"]
+    assert asyncio.run(renamer.rollback_renamings()) == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "b", "c"]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])
@@ -22,22 +22,23 @@ EXAMPLES_MD_PATH = Path("test/examples.md")
 reformat_examples(EXAMPLES_MD_PATH)
 
 
+@pytest.mark.parametrize("planner", sc.PLANNERS)
 @pytest.mark.parametrize(
     "i, title, example, expected",
     [d.values() for d in extract_examples(EXAMPLES_MD_PATH)[:]],
 )
-def test(i, title, example, expected):
+def test(i, title, example, expected, planner):
     clauses = [(Path(row[0]), row[1]) for row in example]
     fs = FileSystem(PATHS)
     original_fs = set(fs)
     if isinstance(expected, tuple):
         (exception_name, expected_culprit) = expected
         with pytest.raises(EXCEPTIONS[exception_name]) as culprit:
-            sc.secure_clauses(fs, clauses)
+            sc.secure_clauses(fs, clauses, planner)
         assert culprit.value.args[0] == expected_culprit
         assert fs == original_fs
     else:
-        safe_clauses = sc.secure_clauses(fs, clauses)
+        safe_clauses = sc.secure_clauses(fs, clauses, planner)
         additions = {Path(row[1]) for row in expected}
         deletions = {Path(row[0]) for row in expected}
         (additions, deletions) = (additions - deletions, deletions - additions)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import pytest
@@ -14,7 +15,7 @@ def paths():
 
 @pytest.fixture()
 def fs(paths):
-    return FileSystem(paths)
+    return FileSystem(paths, temporary_prefix="TMP")
 
 
 def test_constructor(fs):
@@ -46,6 +47,35 @@ def test_update_with_source_paths_concrete():
     assert Path("./test/test_file_system.py") not in fs  # child of a sibling of `.`
 
 
+def test_update_with_source_paths_concrete_lists_each_parent_once(monkeypatch):
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listed.append(path) or scandir(path))
+    fs = FileSystem()
+    paths = [
+        Path("src/goodies.py"),
+        Path("src/file_system.py"),
+        Path("src/missing.py"),
+    ]
+    with pytest.raises(FileNotFoundError):
+        fs.update_with_source_paths(paths)
+    assert listed == [Path("src")]
+
+
+def test_update_with_source_paths_lazy():
+    fs = FileSystem(lazy=True)
+    fs.update_with_source_paths([Path("src/goodies.py")])
+    assert set(fs) == {Path("src/goodies.py")}  # the siblings are not listed...
+    assert Path("src/file_system.py") in fs  # ... but probed on demand
+    assert Path("src/missing.py") not in fs
+    assert set(fs) == {Path("src/goodies.py"), Path("src/file_system.py")}
+    fs.rename(Path("src/goodies.py"), Path("src/baddies.py"))
+    assert Path("src/goodies.py") not in fs  # although it still exists on the disk
+    assert Path("src/baddies.py") in fs
+    with pytest.raises(FileNotFoundError):
+        fs.update_with_source_paths([Path("src/missing.py")])
+
+
 def test_update_with_source_paths_not_existing(fs):
     paths = [
         Path("/foo/bar"),
@@ -94,24 +124,41 @@ def test_siblings(fs):
 
 
 def test_non_existing_sibling_folder(fs):
-    expected = "/usr/NRXWGYLM-0"
+    expected = "/usr/TMP-0"
     result = str(fs.non_existing_sibling(Path("/usr/local")))
     assert result == expected
 
 
 def test_non_existing_sibling_file(fs):
-    expected = "/etc/PBUW4ZLUMQXGI===-0"
+    expected = "/etc/TMP-0"
     result = str(fs.non_existing_sibling(Path("/etc/xinetd.d")))
     assert result == expected
 
 
 def test_non_existing_sibling_file_with_collision(fs):
-    fs.add(Path("/etc/PBUW4ZLUMQXGI===-0"))
-    expected = "/etc/PBUW4ZLUMQXGI===-1"
+    fs.add(Path("/etc/TMP-0"))
+    expected = "/etc/TMP-1"
     result = str(fs.non_existing_sibling(Path("/etc/xinetd.d")))
     assert result == expected
 
 
+def test_non_existing_sibling_released_and_reused(fs):
+    first = fs.non_existing_sibling(Path("/usr/lib"))
+    second = fs.non_existing_sibling(Path("/usr/bin"))
+    assert (str(first), str(second)) == ("/usr/TMP-0", "/usr/TMP-1")
+    fs.temporary_names.release(first)
+    assert fs.non_existing_sibling(Path("/usr/sbin")) == first
+    assert str(fs.non_existing_sibling(Path("/usr/src"))) == "/usr/TMP-2"
+
+
+def test_non_existing_sibling_session_prefix(paths):
+    fs = FileSystem(paths)
+    result = fs.non_existing_sibling(Path("/usr/local"))
+    assert result.parent == Path("/usr")
+    assert result.name.startswith(f"{fs.temporary_names.prefix}-")
+    assert result not in fs
+
+
 def test_rename_leaf(fs):
     original_fs = set(fs)
     fs.rename(Path("/mnt/floppy"), Path("/mnt/toaster"))
@@ -142,5 +189,31 @@ def test_rename_internal_node(fs):
     }
 
 
+def test_rename_onto_intermediate_node():
+    fs = FileSystem([Path("/foo/bar/baz"), Path("/foo/qux")])
+    fs.rename(Path("/foo/qux"), Path("/foo/bar"))  # `/foo/bar` connects `/foo/bar/baz` only
+    assert set(fs) == {Path("/foo/bar/baz"), Path("/foo/bar")}
+    assert len(fs) == 2
+
+
+def test_set_operations(fs):
+    original_fs = set(fs)
+    assert fs == original_fs
+    assert len(fs) == len(original_fs)
+    fs.discard(Path("/usr/X11R6/lib/tls"))
+    assert original_fs - fs == {Path("/usr/X11R6/lib/tls")}
+    assert type(original_fs - fs) is set
+    assert Path("/usr/X11R6/lib") in fs
+    assert "/usr/X11R6/lib" not in fs
+
+
+def test_exchange(fs):
+    original_fs = set(fs)
+    fs.exchange(Path("/usr/X11R6/lib"), Path("/usr/X11R6/man"))  # a folder and a leaf
+    assert original_fs - fs == {Path("/usr/X11R6/lib/tls")}
+    assert fs - original_fs == {Path("/usr/X11R6/man/tls")}
+    assert len(fs) == len(original_fs)
+
+
 if __name__ == "__main__":  # pragma: no cover
     pytest.main(["-qq", __import__("sys").argv[0]])
@@ -0,0 +1,206 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.git_index import *
+
+
+def git(root, *args, input=None):
+    return subprocess.run(
+        ["git", "-C", root, *args], check=True, stdout=subprocess.PIPE, text=True, input=input
+    ).stdout
+
+
+def commit(root):
+    git(root, "-c", "user.name=A", "-c", "user.email=a@b.c", "commit", "-q", "-m", "initial")
+
+
+@pytest.fixture()
+def repository(tmp_path):
+    git(tmp_path, "init", "-q")
+    for name in ["foo", "bar", "folder/buzz", "folder/sub/qux"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(name)
+    git(tmp_path, "add", ".")
+    (tmp_path / "untracked").touch()
+    return tmp_path
+
+
+def test_repository_root(repository):
+    cache = {}
+    assert repository_root(repository / "folder" / "sub", cache) == repository.resolve()
+    assert cache == {
+        repository.resolve() / "folder" / "sub": repository.resolve(),
+        repository.resolve() / "folder": repository.resolve(),
+        repository.resolve(): repository.resolve(),
+    }
+    assert repository_root(repository / "folder", cache) == repository.resolve()  # cached
+
+
+def test_repository_root_cached_without_resolving(repository, monkeypatch):
+    (cache, root) = ({}, repository.resolve())
+    directory = repository / "folder" / "sub"
+    assert repository_root(directory, cache) == root
+    monkeypatch.setattr(os.path, "realpath", None)  # no more walk along the path
+    assert repository_root(directory, cache) == root
+
+
+def test_repository_root_outside(tmp_path):
+    cache = {}
+    assert repository_root(tmp_path, cache) is None
+    assert cache[Path("/")] is None
+
+
+def test_read_index_entries(repository):
+    result = read_index_entries(repository)
+    assert set(result) == {"foo", "bar", "folder/buzz", "folder/sub/qux"}
+    assert result["foo"].mode == "100644"
+
+
+@pytest.mark.parametrize("batch_class", [IndexBatch, InProcessIndexBatch])
+def test_move_and_flush(repository, batch_class):
+    batch = batch_class(repository_root(repository, {}))
+    arcs = [
+        (repository / "foo", repository / "tmp"),
+        (repository / "bar", repository / "foo"),
+        (repository / "tmp", repository / "bar"),
+        (repository / "folder" / "sub", repository / "folder" / "bus"),
+        (repository / "folder", repository / "redlof"),
+        (repository / "untracked", repository / "still_untracked"),
+    ]
+    flags = []
+    for (source, target) in arcs:
+        source.rename(target)
+        flags.append(batch.move(source, target))
+    assert flags == [True, True, True, True, True, False]
+    batch.flush()
+    assert git(repository, "ls-files").split() == [
+        "bar",
+        "foo",
+        "redlof/bus/qux",
+        "redlof/buzz",
+    ]
+    assert git(repository, "status", "--porcelain", "--untracked-files=no") == "\n".join([
+        "A  bar",
+        "A  foo",
+        "A  redlof/bus/qux",
+        "A  redlof/buzz",
+        "",
+    ])
+    assert git(repository, "diff", "--name-only") == ""  # the worktree matches the index
+
+
+@pytest.mark.parametrize("batch_class", [IndexBatch, InProcessIndexBatch])
+def test_flush_nothing(repository, batch_class):
+    batch = batch_class(repository_root(repository, {}))
+    (repository / "untracked").rename(repository / "still_untracked")
+    assert not batch.move(repository / "untracked", repository / "still_untracked")
+    batch.flush()
+    assert git(repository, "ls-files").split() == ["bar", "folder/buzz", "folder/sub/qux", "foo"]
+
+
+@pytest.mark.parametrize("version", [2, 3, 4])
+def test_index_file_round_trip(repository, version):
+    git(repository, "update-index", "--index-version", str(version))
+    if version >= 3:
+        git(repository, "update-index", "--skip-worktree", "foo")  # an extended flag
+    data = (repository / ".git" / "index").read_bytes()
+    index = IndexFile(repository / ".git" / "index", 20)
+    assert index.version == version
+    paths = [path for (path, _) in index.entries]
+    assert paths == [b"bar", b"folder/buzz", b"folder/sub/qux", b"foo"]
+    assert index.to_bytes() == data
+
+
+def test_index_file_drops_cache_tree(repository):
+    commit(repository)
+    git(repository, "write-tree")  # populate the cache tree extension
+    index = IndexFile(repository / ".git" / "index", 20)
+    assert index.extensions == []
+    (repository / ".git" / "index").write_bytes(index.to_bytes())
+    assert git(repository, "status", "--porcelain", "--untracked-files=no") == ""
+
+
+def test_index_file_corrupted(repository):
+    path = repository / ".git" / "index"
+    data = path.read_bytes()
+    path.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))
+    with pytest.raises(ValueError):
+        IndexFile(path, 20)
+
+
+def test_varint():
+    for value in [0, 1, 127, 128, 255, 16511, 16512, 2**20]:
+        assert decode_varint(encode_varint(value), 0) == (value, len(encode_varint(value)))
+
+
+def test_in_process_sha256(tmp_path):
+    git(tmp_path, "init", "-q", "--object-format=sha256")
+    (tmp_path / "foo").write_text("foo")
+    git(tmp_path, "add", ".")
+    batch = InProcessIndexBatch(tmp_path)
+    (tmp_path / "foo").rename(tmp_path / "bar")
+    assert batch.move(tmp_path / "foo", tmp_path / "bar")
+    batch.flush()
+    assert git(tmp_path, "ls-files", "--stage") == (
+        "100644 " + git(tmp_path, "hash-object", "bar").strip() + " 0\tbar\n"
+    )
+
+
+def test_in_process_lock(repository):
+    batch = InProcessIndexBatch(repository)
+    assert (repository / ".git" / "index.lock").exists()
+    with pytest.raises(FileExistsError):
+        InProcessIndexBatch(repository)
+    batch.flush()  # nothing moved: simply unlock
+    assert not (repository / ".git" / "index.lock").exists()
+    (repository / "foo").rename(repository / "oof")
+    assert batch.move(repository / "foo", repository / "oof")  # lock and read again
+    assert (repository / ".git" / "index.lock").exists()
+    batch.flush()
+    assert not (repository / ".git" / "index.lock").exists()
+    assert "oof" in git(repository, "ls-files").split()
+
+
+def test_in_process_keeps_conflicts(repository):
+    commit(repository)
+    object_name = git(repository, "rev-parse", "HEAD:foo").strip()
+    records = [f"0 {'0' * 40}\tfoo", f"100644 {object_name} 1\tfoo", f"100644 {object_name} 2\tfoo"]
+    git(repository, "update-index", "--index-info", input="\n".join(records) + "\n")
+    batch = InProcessIndexBatch(repository)
+    (repository / "bar").rename(repository / "rab")
+    assert batch.move(repository / "bar", repository / "rab")
+    assert not batch.move(repository / "foo", repository / "oof")  # conflicted
+    batch.flush()
+    assert git(repository, "ls-files", "--unmerged").count("\tfoo\n") == 2
+    assert "rab" in git(repository, "ls-files").split()
+
+
+def test_in_process_worktree(repository):
+    commit(repository)
+    worktree = repository.parent / "worktree"
+    git(repository, "worktree", "add", "-q", worktree)
+    batch = InProcessIndexBatch(worktree)
+    (worktree / "foo").rename(worktree / "oof")
+    assert batch.move(worktree / "foo", worktree / "oof")
+    batch.flush()
+    assert git(worktree, "status", "--porcelain") == "R  foo -> oof\n"
+
+
+@pytest.mark.parametrize("batch_class", [IndexBatch, InProcessIndexBatch])
+def test_exchange(repository, batch_class):
+    batch = batch_class(repository)
+    (repository / "folder").rename(repository / "tmp")
+    (repository / "foo").rename(repository / "folder")
+    (repository / "tmp").rename(repository / "foo")
+    assert batch.exchange(repository / "folder", repository / "foo")
+    assert not batch.exchange(repository / "untracked", repository / "missing")
+    batch.flush()
+    assert git(repository, "ls-files").split() == ["bar", "folder", "foo/buzz", "foo/sub/qux"]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])
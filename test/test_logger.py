@@ -0,0 +1,155 @@
+import os
+from pathlib import Path
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.context import Context
+from src.logger import *
+
+context = Context("mockOS")
+logger = context.logger
+
+
+@pytest.fixture()
+def fsyncs(monkeypatch):
+    result = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: result.append(fd) or fsync(fd))
+    return result
+
+
+@pytest.mark.parametrize("durability, expected_fsyncs", [("none", 0), ("group", 6), ("arc", 9)])
+def test_journal(fsyncs, durability, expected_fsyncs):
+    logger.create_new_log_file()
+    journal = Journal(logger, durability, group_size=2)
+    logger.journal = journal
+    arcs = [Arc(Path(f"s{i}"), Path(f"t{i}")) for i in range(4)]
+    for arc in arcs[:3]:
+        journal.append("", arc)
+    written = logger.get_contents().split("\n")
+    assert written == [f"INFO:root:SOURCE:s{i}\tTARGET:t{i}" for i in range(len(written))]
+    assert len(written) == (3 if durability == "arc" else 2)
+    logger.info("other record")  # commit the pending arc first
+    journal.append("git:", arcs[3])
+    journal.close()
+    assert logger.journal is None
+    assert logger.get_contents().split("\n") == [
+        "INFO:root:SOURCE:s0\tTARGET:t0",
+        "INFO:root:SOURCE:s1\tTARGET:t1",
+        "INFO:root:SOURCE:s2\tTARGET:t2",
+        "INFO:root:other record",
+        "INFO:root:git:SOURCE:s3\tTARGET:t3",
+    ]
+    assert logger.records_path.read_text().split("\n") == [
+        '["", "s0", "t0"]',
+        '["", "s1", "t1"]',
+        '["", "s2", "t2"]',
+        '["git:", "s3", "t3"]',
+        '{"arcs": 4, "errors": 0}',
+        "",
+    ]
+    assert len(fsyncs) == expected_fsyncs  # for the log file and the records, plus the footer
+
+
+def test_records(tmp_path):
+    logger.create_new_log_file()
+    logger.write_records([f'["", "s{i}", "t{i}"]\n' for i in range(1000)], arcs=1000)
+    logger.error("rollback failed")
+    with open(logger.records_path, "a") as file:
+        file.write('["", "interrupted')  # a crash
+    records = list(read_records(logger.records_path, chunk_size=100))
+    assert records[:3] == [
+        {"arcs": 1000, "errors": 1},
+        {"error": "rollback failed"},
+        ["", "s999", "t999"],
+    ]
+    assert records[-1] == ["", "s0", "t0"]
+    assert len(records) == 1002
+    logger.create_new_log_file()
+    assert logger.previous_records_path.is_file()
+    assert not logger.records_path.exists()
+    logger.create_new_log_file()  # the new session has no records
+    assert not logger.previous_records_path.exists()
+
+
+def test_previous_log_file_is_read_lazily(monkeypatch):
+    logger.create_new_log_file()
+    logger.info("previous session")
+    read_paths = []
+    read_text = Path.read_text
+    monkeypatch.setattr(Path, "read_text", lambda path: read_paths.append(path) or read_text(path))
+    logger.create_new_log_file()
+    assert read_paths == [logger.index_path]  # not the log itself
+    monkeypatch.undo()
+    assert logger.get_previous_contents() == "INFO:root:previous session"
+    assert logger.get_contents() == ""
+    logger.path.unlink()  # e.g., no previous session
+    logger.create_new_log_file()
+    assert logger.previous_path is None
+    assert logger.get_previous_contents() == ""
+
+
+def test_rotate_log_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger, "log_dir", tmp_path)
+    monkeypatch.setattr(logger, "path", tmp_path / "log.txt")
+    monkeypatch.setattr(logger, "index_path", tmp_path / "log_index.json")
+    monkeypatch.setattr(logger, "logs_to_keep", 3)
+    monkeypatch.setattr(Path, "glob", None)  # no listing of the workspace
+    for session in range(1, 6):
+        logger.path.write_text(f"session {session}")
+        logger.rotate_log_file()
+        assert logger.previous_path == tmp_path / f"log_{session}.txt"
+    assert [path.read_text() for path in logger.retained_log_paths()] == [
+        "session 3",
+        "session 4",
+        "session 5",
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "log_3.txt",
+        "log_4.txt",
+        "log_5.txt",
+        "log_index.json",
+    ]
+    monkeypatch.setattr(logger, "logs_to_keep", 0)
+    logger.path.write_text("session 6")
+    logger.rotate_log_file()
+    assert logger.retained_log_paths() == [tmp_path / "log_6.txt"]  # needed for undoing
+    assert not (tmp_path / "log_5.txt").exists()
+
+
+def test_journal_failure_does_not_escape_from_logging(monkeypatch):
+    logger.create_new_log_file()
+    journal = logger.open_journal()
+    journal.append("", Arc(Path("s0"), Path("t0")))
+
+    def fail(rows):
+        raise ValueError("store failure")
+
+    monkeypatch.setattr(logger.store, "add_arcs", fail)
+    logger.warning("reporting a failure")  # does not raise
+    assert logger.get_contents().split("\n") == [
+        "INFO:root:SOURCE:s0\tTARGET:t0",
+        "ERROR:root:Failed to write the journal: store failure",
+        "WARNING:root:reporting a failure",
+    ]
+    journal.close()  # nothing is retried
+    assert logger.journal is None
+
+
+def test_journal_unknown_durability():
+    with pytest.raises(ValueError):
+        Journal(logger, "sometimes")
+
+
+def test_open_journal(monkeypatch):
+    monkeypatch.setattr(logger, "journal_durability", "none")
+    journal = logger.open_journal()
+    assert logger.journal is journal
+    assert journal.durability == "none"
+    assert journal.group_size == 64
+    journal.close()
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])
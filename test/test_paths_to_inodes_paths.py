@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 import pytest
@@ -26,5 +27,166 @@ def test_non_existing_paths_to_inodes_paths():
         paths_to_inodes_paths(paths)
 
 
+def test_paths_to_inodes_paths_in_parallel(tmp_path):
+    paths = [tmp_path / f"{i}" for i in range(1000)]
+    for path in paths[::2]:
+        path.touch()
+    with pytest.raises(FileNotFoundError) as error:
+        paths_to_inodes_paths(paths, threads=4)
+    missing = [str(path) for path in paths[1::2]]  # all reported at once, and in order
+    assert str(error.value) == f"500 missing items: {missing}."
+    assert list(iter_inodes(paths, threads=4)) == list(iter_inodes(paths))
+    result = paths_to_inodes_paths(paths[::2], threads=4)
+    assert list(result.values()) == paths[::2]
+    assert result == paths_to_inodes_paths(paths[::2])
+
+
+def test_invalid_paths_to_inodes_paths(tmp_path):
+    (tmp_path / "file").touch()
+    (tmp_path / "loop").symlink_to(tmp_path / "loop")
+    paths = [tmp_path / "file" / "child", tmp_path / "loop" / "child", tmp_path / "missing"]
+    with pytest.raises(FileNotFoundError) as error:
+        paths_to_inodes_paths([tmp_path / "file"] + paths)
+    assert str(error.value) == f"3 missing items: {list(map(str, paths))}."
+
+
+def test_broken_symlink_paths_to_inodes_paths(tmp_path):
+    (tmp_path / "link").symlink_to(tmp_path / "missing")  # the link itself is to be renamed
+    assert paths_to_inodes_paths([tmp_path / "link"]) == {
+        (tmp_path / "link").lstat().st_ino: tmp_path / "link"
+    }
+
+
+def test_empty_paths_to_inodes_paths():
+    with pytest.raises(NoItemToRenameError):
+        paths_to_inodes_paths([])
+
+
+def test_directory_to_inodes_paths(tmp_path):
+    for name in ["foo", "bar"]:
+        (tmp_path / name).touch()
+    (tmp_path / "baz").mkdir()
+    (tmp_path / "baz" / "qux").touch()  # not a child
+    result = directory_to_inodes_paths(tmp_path)
+    assert list(result.values())[0] == tmp_path
+    assert result == paths_to_inodes_paths([tmp_path] + list(tmp_path.iterdir()))
+    with pytest.raises(FileNotFoundError):
+        directory_to_inodes_paths(tmp_path / "missing")
+
+
+def test_walk_inodes_paths(tmp_path):
+    for name in ["a/b/c/d", "a/e", "f"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    (tmp_path / "link").symlink_to(tmp_path / "a")  # not followed
+    names = lambda pairs: sorted(path.relative_to(tmp_path).as_posix() for (_, path) in pairs)
+    assert names(walk_inodes_paths(tmp_path)) == [
+        ".",
+        "a",
+        "a/b",
+        "a/b/c",
+        "a/b/c/d",
+        "a/e",
+        "f",
+        "link",
+    ]
+    assert names(walk_inodes_paths(tmp_path, max_depth=2)) == [".", "a", "a/b", "a/e", "f", "link"]
+    assert names(walk_inodes_paths(tmp_path / "f", max_depth=0)) == ["f"]
+    walker = walk_inodes_paths(tmp_path)
+    assert next(walker) == (tmp_path.lstat().st_ino, tmp_path)  # nothing listed yet
+    assert directory_to_inodes_paths(tmp_path, None) == {
+        path.lstat().st_ino: path for path in [tmp_path, *tmp_path.rglob("*")]
+    }
+
+
+def test_walk_inodes_paths_skips_unreadable_folders(tmp_path, monkeypatch):
+    for name in ["a/b", "c/d"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    scandir = os.scandir
+
+    def scandir_or_fail(path):
+        if path == tmp_path / "a":
+            raise PermissionError(13, "Permission denied", str(path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", scandir_or_fail)
+    errors = []
+    result = directory_to_inodes_paths(tmp_path, None, on_error=errors.append)
+    assert sorted(result.values()) == [tmp_path, tmp_path / "a", tmp_path / "c", tmp_path / "c/d"]
+    assert [error.filename for error in errors] == [str(tmp_path / "a")]
+    assert list(walk_inodes_paths(tmp_path / "c"))  # no error handler is needed
+    with pytest.raises(PermissionError):  # but the directory itself must be readable
+        list(walk_inodes_paths(tmp_path / "a"))
+
+
+def test_walk_inodes_paths_stays_on_the_same_device(tmp_path, monkeypatch):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "b").touch()
+    lstat = os.lstat
+
+    def lstat_on_another_device(path):
+        result = list(lstat(path))
+        result[2] += 1  # st_dev
+        return os.stat_result(result)
+
+    monkeypatch.setattr(os, "lstat", lstat_on_another_device)
+    assert sorted(path for (_, path) in walk_inodes_paths(tmp_path)) == [tmp_path, tmp_path / "a"]
+
+
+def test_walk_inodes_paths_with_filters(tmp_path, monkeypatch):
+    for name in ["a.jpg", "b.png", "c/d.jpg", "c/e.JPG", ".git/f.jpg", "g.jpg/h.txt"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    names = lambda pairs: sorted(path.relative_to(tmp_path).as_posix() for (_, path) in pairs)
+    assert names(walk_inodes_paths(tmp_path, include=["*.jpg"], exclude=[".git"])) == [
+        ".",
+        "a.jpg",
+        "c/d.jpg",
+        "g.jpg",  # a matching folder is included, and walked
+    ]
+    assert names(walk_inodes_paths(tmp_path, include=["re:(?i)\\.jpg$"], exclude=["c"])) == [
+        ".",
+        ".git/f.jpg",
+        "a.jpg",
+        "g.jpg",
+    ]
+    assert names(walk_inodes_paths(tmp_path, max_depth=1, include=["a*", "re:^b"])) == [
+        ".",
+        "a.jpg",
+        "b.png",
+    ]
+    monkeypatch.setattr(os.DirEntry, "inode", None, raising=False)  # no lookup when skipped
+    assert names(walk_inodes_paths(tmp_path, exclude=["*"])) == ["."]
+
+
+def test_compile_name_patterns():
+    assert compile_name_patterns([]) is None
+    matches = compile_name_patterns(["a*", "re:b$"])
+    assert [bool(matches(name)) for name in ["abc", "cab", "bab"]] == [True, True, True]
+    assert not matches("cba")
+    assert not compile_name_patterns(["*.jpg"])("a.jpg.txt")
+
+
+def test_iter_null_separated_paths():
+    (read_fd, write_fd) = os.pipe()
+    with open(read_fd, "rb") as stream:
+        paths = iter_null_separated_paths(stream)
+        os.write(write_fd, b"foo\0bar\nbaz\0\0qu")
+        assert next(paths) == Path("foo")  # while the producer is still running
+        assert next(paths) == Path("bar\nbaz")
+        os.write(write_fd, b"x\0\xff")
+        os.close(write_fd)
+        assert list(paths) == [Path("qux"), Path(os.fsdecode(b"\xff"))]
+
+
+def test_paths_to_inodes_paths_from_iterator(tmp_path):
+    for name in ["foo", "bar"]:
+        (tmp_path / name).touch()
+    paths = [tmp_path / "foo", tmp_path / "bar"]
+    for threads in (1, 2):
+        assert paths_to_inodes_paths(iter(paths), threads) == paths_to_inodes_paths(paths)
+
+
 if __name__ == "__main__":  # pragma: no cover
     pytest.main(["-qq", __import__("sys").argv[0]])
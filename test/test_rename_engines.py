@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.rename_engines import *
+
+
+def test_rename_with_handles(tmp_path):
+    for name in ["foo", "bar", "folder/buzz", "folder/sub/qux"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).touch()
+    engine = DirectoryHandleEngine()
+    engine.rename(tmp_path / "folder" / "sub" / "qux", tmp_path / "folder" / "sub" / "xuq")
+    engine.rename(tmp_path / "folder" / "buzz", tmp_path / "folder" / "zzub")
+    assert list(engine.handles) == [tmp_path / "folder" / "sub", tmp_path / "folder"]
+    engine.rename(tmp_path / "folder", tmp_path / "redlof")  # evict the handles under "folder"
+    assert list(engine.handles) == [tmp_path]
+    engine.rename(tmp_path / "foo", tmp_path / "oof")
+    engine.rename(tmp_path / "bar", tmp_path / "rab")
+    assert list(engine.handles) == [tmp_path]  # opened once
+    engine.close()
+    assert engine.handles == {}
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob("*")) == [
+        "oof",
+        "rab",
+        "redlof",
+        "redlof/sub",
+        "redlof/sub/xuq",
+        "redlof/zzub",
+    ]
+
+
+def test_lru_eviction(tmp_path):
+    engine = DirectoryHandleEngine(max_handles=2)
+    for name in "abc":
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "foo").touch()
+    for name in "abc":
+        engine.rename(tmp_path / name / "foo", tmp_path / name / "bar")
+    assert list(engine.handles) == [tmp_path / "b", tmp_path / "c"]
+    engine.close()
+
+
+def test_error_with_full_paths(tmp_path):
+    engine = DirectoryHandleEngine()
+    with pytest.raises(FileNotFoundError) as error:
+        engine.rename(tmp_path / "missing", tmp_path / "target")
+    assert str(error.value) == (
+        f"[Errno 2] No such file or directory: '{tmp_path}/missing' -> '{tmp_path}/target'"
+    )
+    with pytest.raises(FileNotFoundError) as error:
+        engine.rename(tmp_path / "missing" / "foo", tmp_path / "missing" / "bar")
+    assert str(error.value).endswith(f": '{tmp_path}/missing/foo' -> '{tmp_path}/missing/bar'")
+    engine.close()
+
+
+def test_path_engine_exchange(tmp_path):
+    (tmp_path / "foo").write_text("foo")
+    (tmp_path / "bar").mkdir()
+    PathEngine().exchange(tmp_path / "foo", tmp_path / "bar")
+    assert (tmp_path / "foo").is_dir()
+    assert (tmp_path / "bar").read_text() == "foo"
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+@pytest.mark.skipif(load_renameat2() is None, reason="renameat2 is not available")
+@pytest.mark.parametrize("supported", [True, False])
+def test_renameat2_engine(tmp_path, supported):
+    (tmp_path / "foo").write_text("foo")
+    (tmp_path / "bar").mkdir()
+    (tmp_path / "bar" / "buzz").touch()
+    engine = Renameat2Engine()
+    if not supported:
+        engine.renameat2 = None  # e.g., after an EINVAL
+    engine.exchange(tmp_path / "foo", tmp_path / "bar")
+    assert (tmp_path / "foo" / "buzz").exists()
+    assert (tmp_path / "bar").read_text() == "foo"
+    with pytest.raises(FileExistsError) as error:
+        engine.rename(tmp_path / "foo", tmp_path / "bar")  # no clobbering
+    assert str(error.value) == f"[Errno 17] File exists: '{tmp_path}/foo' -> '{tmp_path}/bar'"
+    engine.rename(tmp_path / "foo" / "buzz", tmp_path / "foo" / "qux")
+    assert (tmp_path / "foo" / "qux").exists()
+    engine.close()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["bar", "foo"]
+
+
+def test_make_rename_engine():
+    assert isinstance(make_rename_engine("path"), PathEngine)
+    with pytest.raises(ValueError):
+        make_rename_engine("directory_handle")  # a typo is not silently ignored
+    if os.rename in os.supports_dir_fd:
+        assert isinstance(make_rename_engine("directory_handles"), DirectoryHandleEngine)
+    if load_renameat2() is not None:
+        assert isinstance(make_rename_engine("renameat2"), Renameat2Engine)
+        assert supports_exchanges("renameat2")
+    assert not supports_exchanges("directory_handles")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])
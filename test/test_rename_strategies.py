@@ -0,0 +1,159 @@
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.context import Context
+from src.rename_engines import DirectoryHandleEngine
+from src.rename_strategies import *
+from src.renamings import Renamer
+from src.user_errors import RecoverableRenamingError
+
+context = Context("mockOS")
+logger = context.logger
+
+
+def test_make_rename_strategy(monkeypatch):
+    assert type(make_rename_strategy(context)) is GitStrategy
+    for (name, strategy_class) in RENAME_STRATEGIES.items():
+        monkeypatch.setitem(context.config, "rename_strategy", name)
+        assert type(make_rename_strategy(context)) is strategy_class
+    monkeypatch.setitem(context.config, "rename_strategy", "unknown")
+    with pytest.raises(ValueError):
+        make_rename_strategy(context)
+    monkeypatch.setitem(context.config, "rename_strategy", "plain")
+    monkeypatch.setitem(context.config, "rename_engine", "directory_handle")
+    with pytest.raises(ValueError):
+        make_rename_strategy(context)
+
+
+def test_rename_batch(tmp_path):
+    for name in "ab":
+        (tmp_path / name).touch()
+    arcs = [
+        Arc(tmp_path / "a", tmp_path / "c"),
+        Arc(tmp_path / "missing", tmp_path / "d"),
+        Arc(tmp_path / "b", tmp_path / "e"),
+    ]
+    results = list(PlainStrategy(context).rename_batch(arcs))
+    assert [(result.arc, result.flags) for result in results] == [(arcs[0], ""), (arcs[1], "")]
+    assert results[0].error is None
+    assert isinstance(results[1].error, FileNotFoundError)  # and the batch stops
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b", "c"]
+
+
+def test_engine_is_kept_across_batches(tmp_path, monkeypatch):
+    for folder in "ab":
+        (tmp_path / folder).mkdir()
+        for i in range(5):
+            (tmp_path / folder / f"{i}").touch()
+    monkeypatch.setitem(context.config, "rename_engine", "directory_handles")
+    strategy = PlainStrategy(context)
+    if type(strategy.engine()) is not DirectoryHandleEngine:
+        pytest.skip("no renaming relative to a directory handle on this platform")
+    opened = []
+    open_ = os.open
+    monkeypatch.setattr(os, "open", lambda *args: opened.append(args[0]) or open_(*args))
+    for i in range(5):  # interleaved parents, as the greedy planner may do
+        for folder in "ab":
+            arc = Arc(tmp_path / folder / f"{i}", tmp_path / folder / f"{i}_")
+            assert list(strategy.rename_batch([arc]))[0].error is None
+    assert opened == [tmp_path / "a", tmp_path / "b"]
+    engine = strategy.engine()
+    strategy.flush()
+    assert not engine.handles  # closed
+    assert strategy.engine() is not engine  # the next session has its own
+
+
+def test_engine_per_thread():
+    strategy = PlainStrategy(context)
+    engines = []
+    thread = threading.Thread(target=lambda: engines.append(strategy.engine()))
+    thread.start()
+    thread.join()
+    assert strategy.engine() is strategy.engine() is not engines[0]
+    assert len(strategy.engines) == 2  # both closed by `flush()`
+    strategy.flush()
+
+
+def test_abstract_strategy():
+    with pytest.raises(TypeError):
+        RenameStrategy(context)
+
+
+def test_dry_run(tmp_path):
+    for name in "ab":
+        (tmp_path / name).touch()
+    strategy = DryRunStrategy(context)
+    arcs = [
+        Arc(tmp_path / "a", tmp_path / "c"),
+        Arc(tmp_path / "b", tmp_path / "a"),  # "a" is free now
+        ExchangeArc(tmp_path / "a", tmp_path / "c"),
+        Arc(tmp_path / "a", tmp_path / "c"),  # but "c" is not
+    ]
+    results = list(strategy.rename_batch(arcs))
+    assert [result.flags for result in results] == ["dry-run:", "dry-run:", "dry-run:exchange:", ""]
+    assert isinstance(results[-1].error, FileExistsError)
+    assert not list(strategy.rename_batch([Arc(tmp_path / "b", tmp_path / "d")]))[0].flags
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "b"]  # nothing changed
+
+
+def test_dry_run_session_cannot_be_undone(tmp_path, monkeypatch):
+    monkeypatch.setitem(context.config, "rename_strategy", "dry-run")
+    renamer = Renamer(context, testing=True)
+    (tmp_path / "a").touch()
+    assert renamer.perform_renamings([Arc(tmp_path / "a", tmp_path / "b")]) == 1
+    assert logger.get_contents().split("\n")[1] == (
+        f"INFO:root:dry-run:SOURCE:{tmp_path}/a\tTARGET:{tmp_path}/b"
+    )
+    assert renamer.get_arcs_for_undoing(logger.get_contents()) == []
+    assert (tmp_path / "a").exists()
+
+
+def test_dry_run_session_is_the_previous_session(tmp_path, monkeypatch):
+    (tmp_path / "a").touch()
+    Renamer(context, testing=True).perform_renamings([Arc(tmp_path / "a", tmp_path / "b")])
+    monkeypatch.setitem(context.config, "rename_strategy", "dry-run")
+    Renamer(context, testing=True).perform_renamings([Arc(tmp_path / "b", tmp_path / "c")])
+    monkeypatch.setitem(context.config, "rename_strategy", "plain")
+    renamer = Renamer(context, testing=True)
+    assert renamer.get_arcs_for_undoing_previous_session() == []  # nothing to undo
+    assert renamer.get_arcs_for_undoing_sessions(2) == [Arc(tmp_path / "b", tmp_path / "a")]
+
+
+def test_custom_strategy(tmp_path, monkeypatch):
+    batches = []
+
+    class RecordingStrategy(PlainStrategy):
+        def rename_batch(self, arcs):
+            arcs = list(arcs)  # e.g., to send them at once to a remote service
+            batches.append([arc.source.name for arc in arcs])
+            return super().rename_batch(arcs)
+
+    monkeypatch.setitem(RENAME_STRATEGIES, "recording", RecordingStrategy)
+    monkeypatch.setitem(context.config, "rename_strategy", "recording")
+    renamer = Renamer(context, testing=True)
+    for name in ["a/x", "a/y", "b/x"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    arcs = [
+        Arc(tmp_path / "a" / "x", tmp_path / "a" / "z"),
+        Arc(tmp_path / "a" / "y", tmp_path / "a" / "x"),
+        Arc(tmp_path / "b" / "x", tmp_path / "b" / "z"),
+        Arc(tmp_path / "a", tmp_path / "c"),
+    ]
+    assert renamer.perform_renamings(arcs) == 4
+    assert batches == [["x", "y"], ["x"], ["a"]]  # consecutive siblings
+    assert sorted(path.relative_to(tmp_path).as_posix() for path in tmp_path.rglob("*")) == [
+        "b",
+        "b/z",
+        "c",
+        "c/x",
+        "c/z",
+    ]
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 import os
+import subprocess
 import pytest
 
 __import__("sys").path[0:0] = "."
@@ -38,6 +39,34 @@ def test_rename():
     rm_tree(base)
 
 
+def test_rename_streamed():
+    """All renamings succeed, while the arcs are produced."""
+    renamer = Renamer(context, testing=True)
+    base = Path("test") / "happy_path"
+    rm_tree(base)
+    base.mkdir()
+    sources = [base / f"source_{i}" for i in range(3)]
+    for source in sources:
+        source.touch()
+
+    def arcs():
+        for (i, source) in enumerate(sources):
+            targets = {base / f"target_{j}" for j in range(i)}
+            assert set(base.iterdir()) == set(sources[i:]) | targets
+            yield Arc(source, base / f"target_{i}")
+
+    assert renamer.perform_streamed_renamings(arcs()) == 3
+    print(logger.get_contents())
+    assert logger.get_contents() == "\n".join([
+        "INFO:root:Streaming the items to rename.",
+        "INFO:root:SOURCE:test/happy_path/source_0\tTARGET:test/happy_path/target_0",
+        "INFO:root:SOURCE:test/happy_path/source_1\tTARGET:test/happy_path/target_1",
+        "INFO:root:SOURCE:test/happy_path/source_2\tTARGET:test/happy_path/target_2",
+        "INFO:root:3 items renamed.",
+    ])
+    rm_tree(base)
+
+
 def test_rename_and_undo():
     """All renamings succeed, then are successfully undone."""
     renamer = Renamer(context, testing=True)
@@ -139,8 +168,10 @@ def test_rename_and_undo_fail_after_log_file_deletion():
     rm_tree(base)
 
 
-def test_rename_fail_and_rollback():
+@pytest.mark.parametrize("rename_engine", ["path", "directory_handles"])
+def test_rename_fail_and_rollback(rename_engine, monkeypatch):
     """One renaming fails, but the previous ones are successfully rolled back."""
+    monkeypatch.setitem(context.config, "rename_engine", rename_engine)
     renamer = Renamer(context, testing=True)
     base = Path("test") / "rollback_path"
     rm_tree(base)
@@ -274,11 +305,12 @@ def test_rename_when_git_is_not_installed():
     ]
     for arc in arcs:
         arc.source.touch()
+    (base / ".git").mkdir()  # a repository of its own, even outside a git checkout
     path_backup = os.environ["PATH"]
     os.environ["PATH"] = ""  # make git unavailable
     renamer.perform_renamings(arcs)
     os.environ["PATH"] = path_backup
-    assert set(base.iterdir()) == set(arc.target for arc in arcs)
+    assert set(base.iterdir()) == set(arc.target for arc in arcs) | {base / ".git"}
     print(logger.get_contents())
     assert logger.get_contents() == "\n".join([
         "INFO:root:3 items to rename.",
@@ -311,5 +343,279 @@ def test_rename_files_under_version_control():
     ])
 
 
+def test_undo_renamings_under_version_control():
+    renamer = Renamer(context, testing=True)
+    log_text = "\n".join([
+        "INFO:root:2 items to rename.",
+        "INFO:root:git:SOURCE:foo/tracked\tTARGET:foo/still_tracked",
+        "INFO:root:SOURCE:foo/untracked\tTARGET:foo/still_untracked",
+        "INFO:root:2 items renamed.",
+    ])
+    assert renamer.get_arcs_for_undoing(log_text) == [
+        Arc(Path("foo/still_untracked"), Path("foo/untracked")),
+        Arc(Path("foo/still_tracked"), Path("foo/tracked")),
+    ]
+
+
+def test_rename_in_parallel_and_rollback(tmp_path, monkeypatch):
+    """The failure of a group stops neither its level's other groups, nor the rollback."""
+    monkeypatch.setitem(context.config, "renaming_threads", 4)
+    renamer = Renamer(context, testing=True)
+    arcs = []
+    for i in range(8):
+        for j in range(4):
+            (tmp_path / f"d{i}" / f"f{j}").mkdir(parents=True)
+            arcs.append(Arc(tmp_path / f"d{i}" / f"f{j}", tmp_path / f"d{i}" / f"g{j}"))
+    arcs.insert(13, Arc(tmp_path / "d3" / "missing", tmp_path / "d3" / "target"))
+    arcs.extend(Arc(tmp_path / f"d{i}", tmp_path / f"e{i}") for i in range(8))
+    original = set(tmp_path.rglob("*"))
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(arcs)
+    assert len(renamer.completed) == 29  # the failing level, except d3/f1 to d3/f3
+    assert (tmp_path / "d3" / "g0").exists() and not (tmp_path / "d3" / "g1").exists()
+    assert not list(tmp_path.glob("e*"))  # the next level has not started
+    logged = [line.partition("SOURCE:")[2] for line in logger.get_contents().split("\n")]
+    logged = [tuple(map(Path, line.split("\tTARGET:"))) for line in logged if line]
+    assert logged == renamer.completed
+    for i in range(8):  # the order of each folder is kept
+        assert [a for a in logged if a[0].parent.name == f"d{i}"] == [
+            a for a in arcs if a.source.parent.name == f"d{i}" and a in logged
+        ]
+    renamer.rollback_renamings()
+    assert set(tmp_path.rglob("*")) == original
+
+
+def test_rename_fail_in_journal_and_rollback(tmp_path, monkeypatch):
+    """An arc performed but not journaled, due to a failing group commit, is rolled back too."""
+    monkeypatch.setattr(logger, "journal_group_size", 2)
+    renamer = Renamer(context, testing=True)
+    (tmp_path / "a").touch()
+    (tmp_path / "b").touch()
+    add_arcs = logger.store.add_arcs
+
+    def add_arcs_once(rows):  # e.g., a locked store, or a full disk
+        monkeypatch.setattr(logger.store, "add_arcs", add_arcs)
+        raise OSError("database is locked")
+
+    monkeypatch.setattr(logger.store, "add_arcs", add_arcs_once)
+    arcs = [Arc(tmp_path / "a", tmp_path / "x"), Arc(tmp_path / "b", tmp_path / "y")]
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(arcs)
+    assert renamer.completed == arcs
+    assert renamer.rollback_renamings() == 2
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "b"]
+
+
+def test_undo_previous_session_with_records(tmp_path):
+    renamer = Renamer(context, testing=True)
+    for name in "abc":
+        (tmp_path / name).write_text(name)
+    arcs = [
+        ExchangeArc(tmp_path / "a", tmp_path / "b"),
+        Arc(tmp_path / "c", tmp_path / "d"),
+    ]
+    renamer.perform_renamings(arcs)
+    renamer = Renamer(context, testing=True)  # a new session
+    arcs_for_undoing = renamer.get_arcs_for_undoing_previous_session()
+    assert arcs_for_undoing == [(tmp_path / "d", tmp_path / "c"), (tmp_path / "b", tmp_path / "a")]
+    assert [type(arc) for arc in arcs_for_undoing] == [Arc, ExchangeArc]
+    renamer.perform_renamings(arcs_for_undoing)
+    assert [(tmp_path / name).read_text() for name in "abc"] == ["a", "b", "c"]
+
+
+def test_undo_previous_session_with_records_and_error(tmp_path):
+    renamer = Renamer(context, testing=True)
+    (tmp_path / "a").touch()
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(
+            [Arc(tmp_path / "a", tmp_path / "b"), Arc(tmp_path / "c", tmp_path)]
+        )
+    (tmp_path / "b").unlink()
+    with pytest.raises(FileNotFoundError):
+        renamer.rollback_renamings()
+    renamer = Renamer(context, testing=True)
+    with pytest.raises(ValueError):
+        renamer.get_arcs_for_undoing_previous_session()
+
+
+def test_undo_previous_session_without_records(tmp_path):
+    renamer = Renamer(context, testing=True)
+    if logger.previous_records_path.exists():  # e.g., recorded by a former version
+        logger.previous_records_path.unlink()
+    logger.previous_path = tmp_path / "log.txt"
+    logger.previous_path.write_text("INFO:root:SOURCE:foo\tTARGET:bar\n")
+    assert renamer.get_arcs_for_undoing_previous_session() == [Arc(Path("bar"), Path("foo"))]
+
+
+def test_undo_several_sessions(tmp_path):
+    (tmp_path / "a").touch()
+    for (source, target) in ["ab", "bc", "cd"]:  # three sessions
+        renamer = Renamer(context, testing=True)
+        renamer.perform_renamings([Arc(tmp_path / source, tmp_path / target)])
+    renamer = Renamer(context, testing=True)
+    session = logger.session
+    assert logger.store.last_session_involving(tmp_path / "b") == session - 2
+    arcs_for_undoing = renamer.get_arcs_for_undoing_sessions(2)
+    assert arcs_for_undoing == [(tmp_path / "d", tmp_path / "c"), (tmp_path / "c", tmp_path / "b")]
+    renamer.perform_renamings(arcs_for_undoing)
+    assert [path.name for path in tmp_path.iterdir()] == ["b"]
+    assert logger.store.last_session_involving(tmp_path / "b") == session
+
+
+def test_undo_several_sessions_skipping_empty_ones(tmp_path):
+    (tmp_path / "a").touch()
+    renamer = Renamer(context, testing=True)
+    renamer.perform_renamings([Arc(tmp_path / "a", tmp_path / "b")])
+    Renamer(context, testing=True)  # e.g., aborted in the editor
+    renamer = Renamer(context, testing=True)
+    renamer.perform_renamings([Arc(tmp_path / "b", tmp_path / "c")])
+    Renamer(context, testing=True)
+    renamer = Renamer(context, testing=True)
+    arcs_for_undoing = renamer.get_arcs_for_undoing_sessions(2)
+    assert arcs_for_undoing == [(tmp_path / "c", tmp_path / "b"), (tmp_path / "b", tmp_path / "a")]
+
+
+def test_undo_several_sessions_with_error(tmp_path):
+    (tmp_path / "a").touch()
+    renamer = Renamer(context, testing=True)
+    renamer.perform_renamings([Arc(tmp_path / "a", tmp_path / "b")])
+    logger.error("rollback_renamings: failure")
+    renamer = Renamer(context, testing=True)
+    renamer.perform_renamings([Arc(tmp_path / "b", tmp_path / "c")])
+    Renamer(context, testing=True)
+    renamer = Renamer(context, testing=True)
+    with pytest.raises(ValueError):
+        renamer.get_arcs_for_undoing_sessions(2)
+    assert renamer.get_arcs_for_undoing_sessions(1) == [(tmp_path / "c", tmp_path / "b")]
+
+
+def test_undo_undecodable_names(tmp_path):
+    source = tmp_path / os.fsdecode(b"caf\xe9")  # not valid UTF-8
+    source.touch()
+    renamer = Renamer(context, testing=True)
+    assert renamer.perform_renamings([Arc(source, tmp_path / "cafe")]) == 1
+    renamer = Renamer(context, testing=True)
+    assert renamer.get_arcs_for_undoing_sessions(1) == [Arc(tmp_path / "cafe", source)]
+    arcs_for_undoing = renamer.get_arcs_for_undoing_previous_session()
+    assert arcs_for_undoing == [Arc(tmp_path / "cafe", source)]
+    renamer.perform_renamings(arcs_for_undoing)
+    assert list(tmp_path.iterdir()) == [source]
+
+
+def test_undo_exchanges():
+    renamer = Renamer(context, testing=True)
+    log_text = "\n".join([
+        "INFO:root:2 items to rename.",
+        "INFO:root:git:exchange:SOURCE:foo/a\tTARGET:foo/b",
+        "INFO:root:exchange:SOURCE:foo/c\tTARGET:foo/d",
+        "INFO:root:2 items renamed.",
+    ])
+    arcs = renamer.get_arcs_for_undoing(log_text)
+    assert arcs == [(Path("foo/d"), Path("foo/c")), (Path("foo/b"), Path("foo/a"))]
+    assert all(isinstance(arc, ExchangeArc) for arc in arcs)
+
+
+@pytest.mark.parametrize("rename_engine", ["path", "renameat2"])
+def test_exchange_and_rollback(tmp_path, rename_engine, monkeypatch):
+    monkeypatch.setitem(context.config, "rename_engine", rename_engine)
+    renamer = Renamer(context, testing=True)
+    for name in "abc":
+        (tmp_path / name).write_text(name)
+    arcs = [
+        ExchangeArc(tmp_path / "b", tmp_path / "c"),
+        ExchangeArc(tmp_path / "a", tmp_path / "b"),
+        Arc(tmp_path / "missing", tmp_path / "d"),
+    ]
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(arcs)
+    assert [(tmp_path / name).read_text() for name in "abc"] == ["c", "a", "b"]
+    renamer.rollback_renamings()
+    assert [(tmp_path / name).read_text() for name in "abc"] == ["a", "b", "c"]
+    assert [line.partition("SOURCE")[0] for line in logger.get_contents().split("\n")][:3] == [
+        "INFO:root:3 items to rename.",
+        "INFO:root:exchange:",
+        "INFO:root:exchange:",
+    ]
+
+
+def test_rename_fail_and_rollback_under_version_control(tmp_path, monkeypatch):
+    """The index is updated in batch, including when the renamings are rolled back."""
+    renamer = Renamer(context, testing=True)
+    run = subprocess.run
+    git = lambda *args: run(
+        ["git", "-C", tmp_path, *args], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    git("init", "-q")
+    for name in ["tracked_0", "tracked_1", "untracked"]:
+        (tmp_path / name).touch()
+    git("add", "tracked_0", "tracked_1")
+    git_commands = []  # the git commands spawned by the renamer
+    monkeypatch.setattr(
+        subprocess,
+        "run",
+        lambda args, **kwargs: git_commands.append(args[3]) or run(args, **kwargs),
+    )
+    arcs = [
+        Arc(tmp_path / "tracked_0", tmp_path / "target_0"),
+        Arc(tmp_path / "untracked", tmp_path / "target_1"),
+        Arc(tmp_path / "tracked_1", tmp_path / "target_2"),
+        Arc(tmp_path / "missing", tmp_path / "target_3"),
+    ]
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(arcs)
+    assert git("ls-files").split() == ["target_0", "target_2"]  # completed renamings only
+    renamer.rollback_renamings()
+    assert git("ls-files").split() == ["tracked_0", "tracked_1"]
+    assert git("status", "--porcelain") == "A  tracked_0\nA  tracked_1\n?? untracked\n"
+    assert git_commands == ["ls-files", "update-index", "update-index"]  # no git process per arc
+    assert [line.partition("SOURCE")[0] for line in logger.get_contents().split("\n")] == [
+        "INFO:root:4 items to rename.",
+        "INFO:root:git:",
+        "INFO:root:",
+        "INFO:root:git:",
+        "WARNING:root:perform_renamings: [Errno 2] No such file or directory: "
+        f"'{tmp_path}/missing' -> '{tmp_path}/target_3'",
+        "INFO:root:3 renamings to roll back.",
+        "INFO:root:git:",
+        "INFO:root:",
+        "INFO:root:git:",
+        "INFO:root:3 renamings rolled back.",
+    ]
+
+
+def test_rename_fail_and_rollback_with_in_process_index(tmp_path, monkeypatch):
+    """Same as above, with the index read and written without any git process."""
+    monkeypatch.setitem(context.config, "git_index", "in-process")
+    renamer = Renamer(context, testing=True)
+    run = subprocess.run
+    git = lambda *args: run(
+        ["git", "-C", tmp_path, *args], check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    git("init", "-q")
+    for name in ["tracked_0", "tracked_1", "untracked"]:
+        (tmp_path / name).touch()
+    git("add", "tracked_0", "tracked_1")
+    git_commands = []  # the git commands spawned by the renamer
+    monkeypatch.setattr(
+        subprocess,
+        "run",
+        lambda args, **kwargs: git_commands.append(args[3]) or run(args, **kwargs),
+    )
+    arcs = [
+        Arc(tmp_path / "tracked_0", tmp_path / "target_0"),
+        Arc(tmp_path / "untracked", tmp_path / "target_1"),
+        Arc(tmp_path / "tracked_1", tmp_path / "target_2"),
+        Arc(tmp_path / "missing", tmp_path / "target_3"),
+    ]
+    with pytest.raises(RecoverableRenamingError):
+        renamer.perform_renamings(arcs)
+    assert not (tmp_path / ".git" / "index.lock").exists()  # released at the end of the batch
+    assert git("ls-files").split() == ["target_0", "target_2"]  # completed renamings only
+    renamer.rollback_renamings()
+    assert git("ls-files").split() == ["tracked_0", "tracked_1"]
+    assert git("status", "--porcelain") == "A  tracked_0\nA  tracked_1\n?? untracked\n"
+    assert git_commands == []
+
+
 if __name__ == "__main__":  # pragma: no cover
     pytest.main(["-qq", __import__("sys").argv[0]])
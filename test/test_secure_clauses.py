@@ -1,5 +1,7 @@
+import os
 import pytest
 
+from functools import partial
 from pathlib import Path
 
 __import__("sys").path[0:0] = "."
@@ -13,7 +15,7 @@ def paths():
 
 @pytest.fixture()
 def fs(paths):
-    return FileSystem(paths)
+    return FileSystem(paths, temporary_prefix="TMP")
 
 
 def test_secure_clauses(fs):
@@ -27,9 +29,9 @@ def test_secure_clauses(fs):
     assert result == [
         (Path("/usr/X11R6/include"), Path("/usr/X11R6/foobar")),
         (Path("/usr/local"), Path("/usr/bocal")),
-        (Path("/usr/include"), Path("/usr/NFXGG3DVMRSQ====-0")),
+        (Path("/usr/include"), Path("/usr/TMP-0")),
         (Path("/usr/lib"), Path("/usr/include")),
-        (Path("/usr/NFXGG3DVMRSQ====-0"), Path("/usr/lib")),
+        (Path("/usr/TMP-0"), Path("/usr/lib")),
     ]
     expected_fs_subset = {
         Path("/usr/bin"),
@@ -82,13 +84,175 @@ def test_secure_clauses_with_intermediate_clash(fs):
     ]
     result = secure_clauses(fs, clauses)
     assert result == [
-        (Path("/usr/X11R6/lib"), Path("/usr/X11R6/NRUWE===-0")),
+        (Path("/usr/X11R6/lib"), Path("/usr/X11R6/TMP-0")),
         (Path("/usr/X11R6/man"), Path("/usr/X11R6/foo")),
-        (Path("/usr/X11R6/NRUWE===-0"), Path("/usr/X11R6/man")),
+        (Path("/usr/X11R6/TMP-0"), Path("/usr/X11R6/man")),
         (Path("/usr/X11R6"), Path("/usr/bar")),
     ]
 
 
+def test_secure_clauses_by_cycles(fs):
+    clauses = [
+        (Path("/usr/X11R6/include"), "foobar"),
+        (Path("/usr/local"), "bocal"),
+        (Path("/usr/include"), "lib"),
+        (Path("/usr/lib"), "include"),
+    ]
+    result = secure_clauses(fs, clauses, "cycles")
+    assert result == [
+        (Path("/usr/X11R6/include"), Path("/usr/X11R6/foobar")),
+        (Path("/usr/local"), Path("/usr/bocal")),
+        (Path("/usr/include"), Path("/usr/TMP-0")),
+        (Path("/usr/lib"), Path("/usr/include")),
+        (Path("/usr/TMP-0"), Path("/usr/lib")),
+    ]
+
+
+def test_secure_clauses_by_cycles_with_intermediate_clash(fs):
+    clauses = [
+        (Path("/usr/X11R6/lib"), "man"),
+        (Path("/usr/X11R6/man"), "foo"),
+        (Path("/usr/X11R6"), "bar"),
+    ]
+    result = secure_clauses(fs, clauses, "cycles")
+    assert result == [  # a chain, executed backwards
+        (Path("/usr/X11R6/man"), Path("/usr/X11R6/foo")),
+        (Path("/usr/X11R6/lib"), Path("/usr/X11R6/man")),
+        (Path("/usr/X11R6"), Path("/usr/bar")),
+    ]
+
+
+def test_secure_clauses_by_cycles_reuses_temporary_name():
+    fs = FileSystem([Path(f"/{name}") for name in "abcdefg"], temporary_prefix="TMP")
+    clauses = [
+        (Path("/a"), "b"),  # first cycle
+        (Path("/b"), "c"),
+        (Path("/c"), "a"),
+        (Path("/d"), "e"),  # second cycle
+        (Path("/e"), "d"),
+        (Path("/f"), "f"),  # null renaming
+    ]
+    result = secure_clauses(fs, clauses, "cycles")
+    assert result == [
+        (Path("/a"), Path("/TMP-0")),
+        (Path("/c"), Path("/a")),
+        (Path("/b"), Path("/c")),
+        (Path("/TMP-0"), Path("/b")),
+        (Path("/d"), Path("/TMP-0")),
+        (Path("/e"), Path("/d")),
+        (Path("/TMP-0"), Path("/e")),
+    ]
+
+
+def test_secure_clauses_by_exchanges():
+    fs = FileSystem([Path(f"/{name}") for name in "abcdef"], temporary_prefix="TMP")
+    original_fs = set(fs)
+    clauses = [
+        (Path("/a"), "b"),  # a cycle of length 3
+        (Path("/b"), "c"),
+        (Path("/c"), "a"),
+        (Path("/d"), "e"),  # a swap
+        (Path("/e"), "d"),
+        (Path("/f"), "g"),  # a chain
+    ]
+    result = secure_clauses(fs, clauses, "exchanges")
+    assert result == [
+        (Path("/f"), Path("/g")),
+        (Path("/b"), Path("/c")),
+        (Path("/a"), Path("/b")),
+        (Path("/d"), Path("/e")),
+    ]
+    assert [type(arc) for arc in result] == [Arc, ExchangeArc, ExchangeArc, ExchangeArc]
+    assert original_fs - fs == {Path("/f")}
+    assert fs - original_fs == {Path("/g")}
+    assert fs.temporary_names.allocated == set()
+
+
+def test_secure_clauses_by_cycles_shift():
+    n = 100
+    fs = FileSystem([Path(f"/{i:03}") for i in range(1, n + 1)])
+    clauses = [(Path(f"/{i:03}"), f"{i + 1:03}") for i in range(1, n + 1)]
+    result = secure_clauses(fs, clauses, "cycles")
+    assert len(result) == n  # no intermediate renaming
+    assert result[0] == (Path(f"/{n:03}"), Path(f"/{n + 1:03}"))
+    assert count_greedy_arcs(clauses) == 2 * n - 1
+
+
+def test_secure_clauses_with_unknown_planner(fs):
+    with pytest.raises(ValueError):
+        secure_clauses(fs, [(Path("/usr/lib"), "bil")], "foobar")
+
+
+def test_count_greedy_arcs(fs):
+    clauses = [
+        (Path("/usr/X11R6/include"), "foobar"),
+        (Path("/usr/local"), "bocal"),
+        (Path("/usr/include"), "lib"),
+        (Path("/usr/lib"), "include"),
+    ]
+    assert count_greedy_arcs(clauses) == len(secure_clauses(fs, clauses)) == 5
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_secure_clauses_in_parallel(paths, planner):
+    clauses = [
+        (Path("/usr/X11R6/lib/tls"), "sls"),
+        (Path("/usr/X11R6/include"), "lib"),
+        (Path("/usr/X11R6/lib"), "include"),
+        (Path("/usr/include"), "lib"),
+        (Path("/usr/lib"), "include"),
+        (Path("/usr/X11R6"), "X12R7"),
+        (Path("/usr/local"), "bocal"),
+        (Path("/etc/X11"), "X12"),
+    ]
+    factory = partial(FileSystem, paths, temporary_prefix="TMP")
+    result = secure_clauses_in_parallel(clauses, 3, factory, planner)
+    expected = secure_clauses(factory(), clauses, planner)
+    assert sorted(result) == sorted(expected)
+    levels = [len(arc.source.parts) for arc in result]
+    assert levels == sorted(levels, reverse=True)  # the most nested first
+    for parent in (Path("/usr"), Path("/usr/X11R6")):  # same order inside each folder
+        assert [arc for arc in result if arc.source.parent == parent] == [
+            arc for arc in expected if arc.source.parent == parent
+        ]
+
+
+def test_secure_clauses_in_parallel_with_error(paths):
+    clauses = [
+        (Path("/usr/lib"), "bil"),
+        (Path("/etc/X11"), "X12"),
+        (Path("/etc/missing"), "found"),
+    ]
+    factory = partial(FileSystem, paths)
+    with pytest.raises(FileNotFoundError) as offending_path:
+        secure_clauses_in_parallel(clauses, 2, factory)
+    assert offending_path.value.args[0] == "File not found: '/etc/missing'."
+
+
+def test_iter_secure_clauses(fs, paths):
+    clauses = [
+        (Path("/usr/X11R6/include"), "foobar"),
+        (Path("/usr/local"), "bocal"),
+        (Path("/usr/include"), "lib"),
+        (Path("/usr/lib"), "include"),
+    ]
+    arcs = iter_secure_clauses(fs, clauses)
+    assert next(arcs) == (Path("/usr/X11R6/include"), Path("/usr/X11R6/foobar"))
+    assert Path("/usr/X11R6/foobar") in fs  # the first level is secured...
+    assert Path("/usr/bocal") not in fs  # ... but not the second one yet
+    assert [next(arcs)] + list(arcs) == secure_clauses(
+        FileSystem(paths, temporary_prefix="TMP"), clauses
+    )[1:]
+
+
+def test_iter_secure_clauses_raises_before_streaming(fs):
+    clauses = [
+        (Path("/usr/lib/games"), "X11"),
+    ]
+    with pytest.raises(SeveralSourcesError):
+        iter_secure_clauses(fs, clauses)  # no need to consume the result
+
+
 def test_dict_of_clauses():
     clauses = [
         (Path("/foo/bar"), "buzz"),
@@ -140,6 +304,32 @@ def test_check_injectivity_with_external_problem(fs):
     assert offending_path.value.args[0] == "At least two distinct sources for '/usr/lib/X11'."
 
 
+def test_check_injectivity_with_lazy_file_system():
+    fs = FileSystem(lazy=True)
+    clauses = {
+        Path("src/goodies.py"): "file_system.py",
+    }
+    fs.update_with_source_paths(clauses)
+    with pytest.raises(SeveralSourcesError) as offending_path:
+        check_injectivity(fs, clauses)
+    assert offending_path.value.args[0] == "At least two distinct sources for 'src/file_system.py'."
+
+
+def test_case_only_renaming_with_lazy_file_system(tmp_path, monkeypatch):
+    for name in ["foo", "bar", "baz"]:
+        (tmp_path / name).touch()
+    lstat = os.lstat
+    folded = lambda path: Path(path).with_name(Path(path).name.lower())
+    monkeypatch.setattr(os, "lstat", lambda path: lstat(folded(path)))  # case-insensitive
+    fs = FileSystem(lazy=True)
+    clauses = [Clause(tmp_path / "foo", "Foo")]
+    assert secure_clauses(fs, clauses) == [Arc(tmp_path / "foo", tmp_path / "Foo")]
+    fs = FileSystem(lazy=True)
+    clauses = [Clause(tmp_path / "bar", "Baz")]  # another item
+    with pytest.raises(SeveralSourcesError):
+        secure_clauses(fs, clauses)
+
+
 def test_sorted_by_level():
     _ = "whatever"
     clause_dict = {
@@ -0,0 +1,63 @@
+import os
+from pathlib import Path
+
+import pytest
+
+__import__("sys").path[0:0] = "."
+from src.session_store import *
+
+
+@pytest.fixture()
+def store(tmp_path):
+    store = SessionStore(tmp_path / "sessions.sqlite3")
+    yield store
+    store.close()
+
+
+def test_sessions(store):
+    store.start_session(1)
+    store.add_arcs([("", "a", "b"), ("git:", "b", "c")])
+    store.add_arcs([("exchange:", "c", "d")])
+    store.start_session(2)
+    store.add_arcs([("", "d", "e")])
+    store.add_error()
+    store.start_session(3)  # e.g., aborted in the editor
+    store.start_session(4)
+    assert store.last_sessions(5) == [2, 1]
+    assert store.last_sessions(1) == [2]
+    assert store.last_sessions(-1) == []
+    arcs = [("", "a", "b"), ("git:", "b", "c"), ("exchange:", "c", "d")]
+    assert store.session_arcs(1) == (0, arcs)
+    assert store.session_arcs(2) == (1, [("", "d", "e")])
+    assert store.session_arcs(3) == (0, [])
+    assert store.session_arcs(5) == (0, [])
+
+
+def test_last_session_involving(store):
+    for (session, arcs) in enumerate([[("", "a", "b")], [("", "b", "c")], [("", "d", "e")]], 1):
+        store.start_session(session)
+        store.add_arcs(arcs)
+    assert store.last_session_involving(Path("a")) == 1
+    assert store.last_session_involving(Path("b")) == 2
+    assert store.last_session_involving(Path("e")) == 3
+    assert store.last_session_involving(Path("f")) is None
+
+
+def test_undecodable_paths(store):
+    name = os.fsdecode(b"caf\xe9")  # not valid UTF-8
+    store.start_session(1)
+    store.add_arcs([("", name, "cafe")])
+    assert store.session_arcs(1) == (0, [("", name, "cafe")])
+    assert store.last_session_involving(Path(name)) == 1
+
+
+def test_restart_session(store):
+    store.start_session(1)
+    store.add_arcs([("", "a", "b")])
+    store.start_session(1)  # e.g., after the loss of the log index
+    store.add_arcs([("", "c", "d")])
+    assert store.session_arcs(1) == (0, [("", "c", "d")])
+
+
+if __name__ == "__main__":  # pragma: no cover
+    pytest.main(["-qq", __import__("sys").argv[0]])